@@ -1,16 +1,32 @@
 import os
+import io
 import json
 import time
+import secrets
 from datetime import datetime, timedelta, date
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, send_file, abort
 from email_validator import validate_email, EmailNotValidError
 from dotenv import load_dotenv
 from flask_wtf.csrf import CSRFProtect, generate_csrf
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from itsdangerous import TimestampSigner, BadSignature
 from functools import wraps
 import re
+from newsletter_template import read_unsubscribe_token
+import suppressions
+from rate_limit import rate_limited
+from subscribe_batcher import SubscribeBatcher
+from search import init_search, search_submissions
+import image_proxy
+import jobs
+import queries
+import profiler
+import offers
+from stale_cache import StaleCache
+import psycopg2
+from psycopg2 import OperationalError
+from db import get_db_connection, get_read_connection, pin_to_primary, apply_role_statement_timeout
 
 # ==========================
 # 🔐 Chargement variables d'environnement
@@ -19,6 +35,12 @@ load_dotenv()
 
 app = Flask(__name__)
 
+# Derrière le routeur de l'hébergeur : on ne croit que les TRUSTED_PROXIES
+# dernières entrées de X-Forwarded-For (le reste est fourni par le client)
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "1"))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
 # MOT DE PASSE ADMIN depuis variable d'environnement
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin2025")
 
@@ -38,48 +60,57 @@ STATS_FILE = 'stats.json'
 META_FILE = 'newsletter_meta.json'
 
 # ==========================
-# 🗄️ Connexion PostgreSQL
+# 🗄️ Connexion PostgreSQL (primaire + réplique optionnelle, voir db.py)
 # ==========================
-DATABASE_URL = os.getenv("DATABASE_URL")
+# Routes qui écrivent sans relire ensuite : inutile d'épingler la session
+NO_PIN_ENDPOINTS = {"subscribe", "brevo_webhook", "mailgun_webhook"}
 
-def get_db_connection():
-    return psycopg2.connect(DATABASE_URL, sslmode="require", cursor_factory=RealDictCursor)
+@app.after_request
+def pin_session_after_write(response):
+    """Lecture de ses propres écritures : après un POST, la session lit sur la primaire"""
+    if request.method == "POST" and request.endpoint not in NO_PIN_ENDPOINTS and response.status_code < 400:
+        pin_to_primary()
+    return response
+
+# ==========================
+# 🔬 Profilage à la demande (armé depuis /admin/profiles, voir profiler.py)
+# ==========================
+@app.before_request
+def profile_request_start():
+    profiler.request_started(request.url_rule.rule if request.url_rule else None, request.path)
+
+@app.teardown_request
+def profile_request_end(exc):
+    profiler.request_finished()
 
 # ==========================
 # 💾 SYSTÈME DE CACHE (OPTIMISATION)
 # ==========================
-_cache = {
-    'subscriber_count': {'value': 0, 'timestamp': 0},
-    'subscribers_list': {'value': [], 'timestamp': 0}
-}
+# Valeurs périmées servies tout de suite puis rechargées en arrière-plan (voir
+# stale_cache.py) : le réveil de Neon ou une panne ne bloquent plus la page.
+_cache = StaleCache()
 
 CACHE_DURATION = 300  # 5 minutes en secondes
+NEWSLETTER_CACHE_DURATION = 60
+
+def _count_subscribers():
+    conn = get_read_connection(respect_pin=False)
+    try:
+        return queries.fetch_one(conn, "count_subscribers")['count']
+    finally:
+        conn.close()
+
+def lookup_subscriber_count():
+    """(nombre d'abonnés, chargé) : chargé=False si la base n'a jamais répondu (0 par défaut)"""
+    return _cache.lookup('subscriber_count', _count_subscribers, CACHE_DURATION, default=0)
 
 def get_cached_subscriber_count():
-    """Récupère le nombre d'abonnés avec cache de 5 minutes"""
-    now = time.time()
-    if now - _cache['subscriber_count']['timestamp'] > CACHE_DURATION:
-        try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) as count FROM subscribers")
-            count = cur.fetchone()['count']
-            cur.close()
-            conn.close()
-            
-            _cache['subscriber_count']['value'] = count
-            _cache['subscriber_count']['timestamp'] = now
-        except Exception as e:
-            print(f"Erreur cache subscriber count: {e}")
-            # En cas d'erreur, retourner la dernière valeur en cache
-            return _cache['subscriber_count']['value']
-    
-    return _cache['subscriber_count']['value']
+    """Nombre d'abonnés (cache de 5 minutes, servi périmé pendant le rechargement)"""
+    return lookup_subscriber_count()[0]
 
 def invalidate_subscriber_cache():
     """Invalide le cache des abonnés (appelé après ajout/suppression)"""
-    _cache['subscriber_count']['timestamp'] = 0
-    _cache['subscribers_list']['timestamp'] = 0
+    _cache.invalidate('subscriber_count')
 
 # ==========================
 # 🚀 Cache pour les fichiers statiques
@@ -93,10 +124,37 @@ def add_cache_headers(response):
         response.cache_control.public = True
     return response
 
+# ==========================
+# 🩹 Base injoignable : page dégradée plutôt qu'une erreur 500 après un long délai
+# ==========================
+@app.errorhandler(OperationalError)
+def database_unavailable(e):
+    print(f"Base de données indisponible: {e}")
+    if request.path == "/feed.xml":
+        # Lecteurs RSS : pas de page HTML, ils réessaieront après Retry-After
+        response = app.response_class("", mimetype="application/rss+xml")
+    elif request.path.startswith(("/search", "/api/", "/webhooks/")) or request.accept_mimetypes.best == "application/json":
+        response = jsonify({"error": "Service momentanément indisponible"})
+    else:
+        response = app.make_response(render_template("unavailable.html"))
+    response.status_code = 503
+    response.headers["Retry-After"] = "30"
+    if request.path.startswith("/api/") or request.path == "/feed.xml":
+        # Comme les réponses normales (offers.payload_response) : lisible depuis un autre site
+        response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+# Verrou consultatif de init_db : les workers gunicorn et le worker de tâches
+# démarrent en même temps, un seul applique les migrations à la fois
+INIT_DB_LOCK_KEY = 7_201_845_301
+
 # Création des tables
 def init_db():
     conn = get_db_connection()
     cur = conn.cursor()
+    # Migrations et rattrapage de l'index de recherche : pas de limite de durée
+    cur.execute("SET LOCAL statement_timeout = 0")
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (INIT_DB_LOCK_KEY,))
     
     cur.execute("""
         CREATE TABLE IF NOT EXISTS subscribers (
@@ -135,11 +193,34 @@ def init_db():
         )
     """)
     
+    # Brouillons générés par le worker (tâche render_newsletter), servis sur /newsletter-test
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS newsletter_drafts (
+            id SERIAL PRIMARY KEY,
+            html TEXT NOT NULL,
+            submission_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    
+    cur.execute(suppressions.CREATE_TABLE_SQL)
+    init_search(cur)
+    jobs.init_jobs(cur)
+    cur.execute(offers.INDEX_SQL)
+    
     conn.commit()
     cur.close()
+    apply_role_statement_timeout(conn)
     conn.close()
 
-init_db()
+try:
+    init_db()
+except OperationalError as e:
+    # Le worker démarre quand même : pages en cache ou dégradées jusqu'au retour de la base
+    print(f"Base injoignable au démarrage, tables non vérifiées: {e}")
+except psycopg2.Error as e:
+    # Migration en échec : on le signale sans empêcher le worker de servir
+    print(f"Erreur migration au démarrage, tables non vérifiées: {e}")
 
 # ==========================
 # 🛡️ Décorateurs d'authentification
@@ -159,11 +240,8 @@ def approved_user_required(f):
         if 'user_id' not in session:
             return redirect(url_for('user_login'))
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT status FROM users WHERE id = %s", (session['user_id'],))
-        user = cur.fetchone()
-        cur.close()
+        conn = get_read_connection()
+        user = queries.fetch_one(conn, "user_status", session['user_id'])
         conn.close()
         
         if not user or user['status'] != 'approved':
@@ -176,6 +254,10 @@ def approved_user_required(f):
 # 📩 Newsletter
 # ==========================
 def load_newsletter_content():
+    return _cache.get('newsletter_content', _read_newsletter_content, NEWSLETTER_CACHE_DURATION,
+                      default="<p>La newsletter n'est pas encore disponible.</p>")
+
+def _read_newsletter_content():
     use_new = False
     if os.path.exists(META_FILE):
         with open(META_FILE, "r", encoding="utf-8") as f:
@@ -196,59 +278,89 @@ def load_newsletter_content():
 # ==========================
 def load_subscribers():
     """Charge la liste complète des abonnés (utilisé uniquement dans l'admin)"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT email FROM subscribers ORDER BY subscribed_at DESC")
-    subscribers = [row["email"] for row in cur.fetchall()]
-    cur.close()
+    conn = get_read_connection()
+    subscribers = [row["email"] for row in queries.fetch_all(conn, "subscriber_emails")]
     conn.close()
     return subscribers
 
-def save_subscriber(email):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("INSERT INTO subscribers (email) VALUES (%s) ON CONFLICT DO NOTHING", (email,))
-        conn.commit()
-        # Invalider le cache après ajout
-        invalidate_subscriber_cache()
-    except Exception as e:
-        print(f"Erreur insertion subscriber: {e}")
-    finally:
-        cur.close()
-        conn.close()
+# Regroupement optionnel des inscriptions simultanées (ex : SUBSCRIBE_BATCH_WINDOW_MS=5)
+SUBSCRIBE_BATCH_WINDOW = float(os.getenv("SUBSCRIBE_BATCH_WINDOW_MS", "0")) / 1000
+subscribe_batcher = SubscribeBatcher(get_db_connection, window=SUBSCRIBE_BATCH_WINDOW) if SUBSCRIBE_BATCH_WINDOW else None
+
+def add_subscriber(email):
+    """Ajoute un abonné en un seul aller-retour ; True si nouveau, False s'il existait"""
+    if subscribe_batcher:
+        inserted = subscribe_batcher.insert(email)
+    else:
+        conn = get_db_connection()
+        try:
+            inserted = queries.fetch_one(conn, "insert_subscriber", email) is not None
+            conn.commit()
+        finally:
+            conn.close()
+
+    if inserted:
+        # Pas besoin de recompter : on incrémente la valeur en cache
+        _cache.update('subscriber_count', lambda count: count + 1)
+    return inserted
 
 def delete_subscriber_db(email):
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM subscribers WHERE email = %s", (email,))
+    queries.execute(conn, "delete_subscriber", email)
     conn.commit()
-    cur.close()
     conn.close()
     # Invalider le cache après suppression
     invalidate_subscriber_cache()
 
-def check_subscriber_exists(email):
-    """Vérifie si un email existe déjà (requête optimisée)"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM subscribers WHERE email = %s LIMIT 1", (email,))
-    exists = cur.fetchone() is not None
-    cur.close()
-    conn.close()
-    return exists
-
 # ==========================
 # 🌍 Routes publiques (OPTIMISÉES)
 # ==========================
+# La page d'accueil est identique pour tous (hors compteur) : aucun cookie de
+# session, elle peut être mise en cache par un CDN / reverse proxy. Le jeton
+# anti-bot (heure d'affichage signée) et le jeton CSRF sont propres à chaque
+# visite : le JS du formulaire les récupère sur /form-token, jamais mis en cache.
+HOME_CACHE_SECONDS = int(os.getenv("HOME_CACHE_SECONDS", "60"))
+FORM_MIN_SECONDS = 2
+FORM_MAX_AGE = 7200
+
+_form_signer = TimestampSigner(app.secret_key, salt="subscribe-form")
+
+def form_token_age(token):
+    """Secondes écoulées depuis l'affichage du formulaire, ou None si le jeton est invalide/expiré"""
+    try:
+        _, signed_at = _form_signer.unsign(token, max_age=FORM_MAX_AGE, return_timestamp=True)
+    except BadSignature:
+        return None
+    return time.time() - signed_at.timestamp()
+
 @app.route("/")
 def index():
     # Utilise le cache au lieu de charger tous les abonnés
-    subscriber_count = get_cached_subscriber_count()
-    session["form_start_time"] = time.time()
-    return render_template("index.html", subscriber_count=subscriber_count)
+    subscriber_count, loaded = lookup_subscriber_count()
+    if not loaded:
+        # Worker à froid et base injoignable : ce "0" ne doit pas rester dans le CDN
+        response = app.make_response(render_template("index.html", subscriber_count=subscriber_count))
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    etag = str(subscriber_count)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(render_template("index.html", subscriber_count=subscriber_count))
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = f"public, max-age=0, s-maxage={HOME_CACHE_SECONDS}"
+    return response
+
+@app.route("/form-token")
+def form_token():
+    """Jetons du formulaire d'inscription pour cette visite (nonce signé + CSRF)"""
+    response = jsonify(form_token=_form_signer.sign(secrets.token_urlsafe(12)).decode(),
+                       csrf_token=generate_csrf())
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
 @app.route("/subscribe", methods=["POST"])
+@rate_limited("subscribe")
 def subscribe():
     email = request.form.get("email", "").strip().lower()
     honeypot = request.form.get("website", "")
@@ -256,8 +368,10 @@ def subscribe():
     if honeypot != "":
         return "Suspicious activity detected", 400
 
-    start_time = session.get("form_start_time", 0)
-    if time.time() - start_time < 2:
+    age = form_token_age(request.form.get("form_token", ""))
+    if age is None:
+        return "Formulaire expiré, veuillez recharger la page", 400
+    if age < FORM_MIN_SECONDS:
         return "Formulaire soumis trop rapidement", 400
 
     try:
@@ -266,20 +380,107 @@ def subscribe():
     except EmailNotValidError:
         return "Adresse email invalide", 400
 
-    # Utilise la fonction optimisée
-    if check_subscriber_exists(email):
-        subscriber_count = get_cached_subscriber_count()
-        return render_template("already_subscribed.html", subscriber_count=subscriber_count)
-    else:
-        save_subscriber(email)
-        subscriber_count = get_cached_subscriber_count()
+    # Un seul INSERT ... ON CONFLICT DO NOTHING RETURNING décide de la page
+    try:
+        inserted = add_subscriber(email)
+    except Exception as e:
+        print(f"Erreur insertion subscriber: {e}")
+        return "Erreur lors de l'inscription, veuillez réessayer.", 500
+
+    subscriber_count = get_cached_subscriber_count()
+    if inserted:
         return render_template("success.html", subscriber_count=subscriber_count)
+    return render_template("already_subscribed.html", subscriber_count=subscriber_count)
+
+@app.route("/unsubscribe/<token>", methods=["GET", "POST"])
+@csrf.exempt  # le jeton signé du lien suffit ; le POST "One-Click" (RFC 8058) vient du client mail, sans session
+def unsubscribe(token):
+    """Désinscription via le lien personnalisé présent dans chaque email.
+
+    Le GET n'affiche qu'une confirmation : les antivirus et les aperçus de
+    liens (Outlook Safe Links...) ouvrent les URL des emails sans clic.
+    """
+    email = read_unsubscribe_token(token)
+    if not email:
+        return "Lien de désinscription invalide", 400
+    if request.method == "GET":
+        return render_template("unsubscribe.html", email=email, done=False)
+
+    # Suppression + ligne `suppressions` : aussi respectée par l'envoi SMTP (subscribers.json)
+    conn = get_db_connection()
+    queries.execute(conn, "unsubscribe", email)
+    conn.commit()
+    conn.close()
+    invalidate_subscriber_cache()
+    if request.form.get("List-Unsubscribe") == "One-Click":
+        return "", 204
+    return render_template("unsubscribe.html", email=email, done=True)
 
 @app.route("/newsletter")
 def newsletter():
     content = load_newsletter_content()
     return render_template("newsletter_page.html", newsletter_content=content)
 
+@app.route("/search")
+def search_offers():
+    """Recherche dans les offres publiées (JSON, pagination par curseur)"""
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"results": [], "next": None})
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 50)
+
+    conn = get_read_connection()
+    rows, next_cursor = search_submissions(conn, query, published_only=True,
+                                           after=request.args.get("after"), limit=limit)
+    conn.close()
+
+    results = [{
+        "id": row["id"],
+        "title": row["title"],
+        "description": row["description"],
+        "category": row["category"],
+        "company_name": row["company_name"],
+        "image_url": row["image_url"],
+        "link_url": row["link_url"],
+    } for row in rows]
+    return jsonify({"results": results, "next": next_cursor})
+
+# ==========================
+# 📡 Offres publiées pour les partenaires : API JSON et flux RSS (voir offers.py)
+# ==========================
+offer_cache = offers.PayloadCache()
+
+def _load_offers(category, after_date, after_id, limit):
+    conn = get_read_connection(respect_pin=False)
+    try:
+        return queries.fetch_all(conn, "published_offers", category, after_date, after_id, limit)
+    finally:
+        conn.close()
+
+@app.route("/api/offers")
+def api_offers():
+    """Offres publiées (JSON, pagination par curseur, filtre ?category=)"""
+    category = request.args.get("category", "").strip() or None
+    limit = min(max(request.args.get("limit", 20, type=int), 1), offers.OFFERS_MAX_LIMIT)
+    after_date, after_id = offers.parse_cursor(request.args.get("after"))
+
+    payload = offer_cache.get(
+        ("api", category, after_date, after_id, limit),
+        lambda: offers.offers_json(_load_offers(category, after_date, after_id, limit + 1), limit),
+        "application/json",
+    )
+    return offers.payload_response(payload)
+
+@app.route("/feed.xml")
+def offers_feed():
+    category = request.args.get("category", "").strip() or None
+    payload = offer_cache.get(
+        ("feed", category),
+        lambda: offers.feed_xml(_load_offers(category, None, None, offers.FEED_SIZE), category),
+        "application/rss+xml; charset=utf-8",
+    )
+    return offers.payload_response(payload, max_age=300)
+
 @app.route("/stats")
 def stats():
     try:
@@ -302,12 +503,58 @@ def commercant():
 
 @app.route("/newsletter-test")
 def newsletter_test():
-    return app.send_static_file("newsletter_draft.html")
+    # Le worker tourne dans un autre conteneur : son brouillon est en base, pas sur disque
+    conn = get_read_connection()
+    draft = queries.fetch_one(conn, "latest_newsletter_draft")
+    conn.close()
+    if draft is None:
+        return app.send_static_file("newsletter_draft.html")
+    return draft["html"]
 
 @app.route('/ads.txt')
 def ads_txt():
     return app.send_static_file('ads.txt'), 200, {'Content-Type': 'text/plain'}
 
+# ==========================
+# 🖼️ Miniatures des images de soumissions
+# ==========================
+image_cache = image_proxy.ThumbnailCache()
+
+@app.route("/img/<int:submission_id>/<version>/<int:width>.<fmt>")
+def submission_image(submission_id, version, width, fmt):
+    if width not in image_proxy.THUMB_WIDTHS or fmt not in image_proxy.FORMATS:
+        abort(404)
+
+    name = image_proxy.cache_name(version, width, fmt)
+    mimetype = image_proxy.FORMATS[fmt][1]
+    path = image_cache.get(name)
+    if path is not None:
+        response = send_file(path, mimetype=mimetype, max_age=31536000)
+    else:
+        conn = get_read_connection()
+        submission = queries.fetch_one(conn, "submission_image_url", submission_id)
+        conn.close()
+
+        # Seules les images de soumissions sont servies (pas de proxy ouvert)
+        if not submission or not submission["image_url"] or image_proxy.url_version(submission["image_url"]) != version:
+            abort(404)
+        try:
+            # Un seul téléchargement par image même si tous les workers la demandent
+            data = image_proxy.get_thumbnail(image_cache, submission["image_url"], name)
+        except image_proxy.UnsafeImageUrl as e:
+            print(f"Miniature {submission_id} refusée: {e}")
+            abort(404)
+        except image_proxy.SourceUnavailable:
+            return redirect(submission["image_url"])
+        except Exception as e:
+            print(f"Erreur miniature {submission_id}: {e}")
+            return redirect(submission["image_url"])
+        response = send_file(io.BytesIO(data), mimetype=mimetype, max_age=31536000)
+
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 # ✅ ROUTE FAVICON (NOUVEAU)
 @app.route('/favicon.ico')
 def favicon():
@@ -318,10 +565,41 @@ def favicon():
         mimetype='image/vnd.microsoft.icon'
     )
 
+# ==========================
+# 📬 Webhooks fournisseurs (bounces, plaintes, désinscriptions)
+# ==========================
+suppression_queue = suppressions.SuppressionQueue(get_db_connection)
+
+@app.route("/webhooks/brevo", methods=["POST"])
+@csrf.exempt
+def brevo_webhook():
+    if not suppressions.verify_brevo_token(request.args.get("token")):
+        return "Forbidden", 403
+    payload = request.get_json(silent=True) or {}
+    # Brevo peut regrouper plusieurs événements dans une liste
+    events = payload if isinstance(payload, list) else [payload]
+    for event in events:
+        parsed = suppressions.parse_brevo_event(event)
+        if parsed:
+            suppression_queue.enqueue(*parsed, "brevo")
+    return "", 204
+
+@app.route("/webhooks/mailgun", methods=["POST"])
+@csrf.exempt
+def mailgun_webhook():
+    payload = request.get_json(silent=True) or {}
+    if not suppressions.verify_mailgun_signature(payload):
+        return "Forbidden", 403
+    parsed = suppressions.parse_mailgun_event(payload)
+    if parsed:
+        suppression_queue.enqueue(*parsed, "mailgun")
+    return "", 204
+
 # ==========================
 # 🔐 Authentification utilisateurs
 # ==========================
 @app.route("/register", methods=["GET", "POST"])
+@rate_limited("register")
 def user_register():
     if request.method == "POST":
         email = request.form.get("email", "").strip().lower()
@@ -344,21 +622,14 @@ def user_register():
             return render_template("auth/register.html")
         
         conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM users WHERE email = %s", (email,))
-        if cur.fetchone():
+        if queries.fetch_one(conn, "user_id_by_email", email):
             flash("Un compte existe déjà avec cette adresse email.", "error")
-            cur.close()
             conn.close()
             return render_template("auth/register.html")
         
         password_hash = generate_password_hash(password)
-        cur.execute("""
-            INSERT INTO users (email, password_hash, company_name, phone)
-            VALUES (%s, %s, %s, %s)
-        """, (email, password_hash, company_name, phone))
+        queries.execute(conn, "insert_user", email, password_hash, company_name, phone)
         conn.commit()
-        cur.close()
         conn.close()
         
         flash("Inscription réussie ! Votre compte sera examiné sous peu.", "success")
@@ -367,6 +638,7 @@ def user_register():
     return render_template("auth/register.html")
 
 @app.route("/login", methods=["GET", "POST"])
+@rate_limited("login")
 def user_login():
     if request.method == "POST":
         email = request.form.get("email", "").strip().lower()
@@ -376,11 +648,8 @@ def user_login():
             flash("Email et mot de passe requis.", "error")
             return render_template("auth/login.html")
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, password_hash, status FROM users WHERE email = %s", (email,))
-        user = cur.fetchone()
-        cur.close()
+        conn = get_read_connection()
+        user = queries.fetch_one(conn, "user_credentials", email)
         conn.close()
         
         if user and check_password_hash(user['password_hash'], password):
@@ -403,20 +672,9 @@ def user_logout():
 @app.route("/dashboard")
 @login_required
 def user_dashboard():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT * FROM users WHERE id = %s", (session['user_id'],))
-    user = cur.fetchone()
-    
-    cur.execute("""
-        SELECT * FROM submissions 
-        WHERE user_id = %s 
-        ORDER BY created_at DESC
-    """, (session['user_id'],))
-    submissions = cur.fetchall()
-    
-    cur.close()
+    conn = get_read_connection()
+    user = queries.fetch_one(conn, "user_profile", session['user_id'])
+    submissions = queries.fetch_all(conn, "user_submissions", session['user_id'])
     conn.close()
     
     return render_template("auth/dashboard.html", user=user, submissions=submissions)
@@ -448,13 +706,8 @@ def submit_newsletter():
             return render_template("submission/create.html")
         
         conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO submissions (user_id, title, description, image_url, link_url, category)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (session['user_id'], title, description, image_url, link_url, category))
+        queries.execute(conn, "insert_submission", session['user_id'], title, description, image_url, link_url, category)
         conn.commit()
-        cur.close()
         conn.close()
         
         flash("Votre soumission a été envoyée ! Elle sera examinée prochainement.", "success")
@@ -466,14 +719,10 @@ def submit_newsletter():
 @approved_user_required
 def edit_submission(submission_id):
     conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT * FROM submissions WHERE id = %s AND user_id = %s", (submission_id, session['user_id']))
-    submission = cur.fetchone()
+    submission = queries.fetch_one(conn, "user_submission", submission_id, session['user_id'])
     
     if not submission:
         flash("Soumission introuvable", "error")
-        cur.close()
         conn.close()
         return redirect(url_for('user_dashboard'))
     
@@ -484,19 +733,15 @@ def edit_submission(submission_id):
         link_url = request.form.get("link_url", "").strip()
         category = request.form.get("category", "general")
         
-        cur.execute("""
-            UPDATE submissions 
-            SET title = %s, description = %s, image_url = %s, link_url = %s, category = %s
-            WHERE id = %s
-        """, (title, description, image_url, link_url, category, submission_id))
+        queries.execute(conn, "update_submission", title, description, image_url, link_url, category,
+                        submission_id, session['user_id'])
         conn.commit()
-        cur.close()
         conn.close()
+        offer_cache.invalidate()
         
         flash("Soumission modifiée avec succès", "success")
         return redirect(url_for('user_dashboard'))
     
-    cur.close()
     conn.close()
     return render_template("submission/edit.html", submission=submission)
 
@@ -504,24 +749,17 @@ def edit_submission(submission_id):
 @login_required
 def delete_submission(submission_id):
     conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Vérifier que la soumission appartient bien à l'utilisateur
-    cur.execute("SELECT * FROM submissions WHERE id = %s AND user_id = %s", (submission_id, session['user_id']))
-    submission = cur.fetchone()
+    # Suppression limitée aux soumissions de l'utilisateur (vérification et suppression en une requête)
+    deleted = queries.fetch_one(conn, "delete_user_submission", submission_id, session['user_id'])
+    conn.commit()
+    conn.close()
+    if deleted:
+        offer_cache.invalidate()
     
-    if not submission:
+    if not deleted:
         flash("Soumission introuvable ou vous n'avez pas l'autorisation", "error")
-        cur.close()
-        conn.close()
         return redirect(url_for('user_dashboard'))
     
-    # Supprimer la soumission
-    cur.execute("DELETE FROM submissions WHERE id = %s", (submission_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
-    
     flash("🗑️ Soumission supprimée avec succès", "success")
     return redirect(url_for('user_dashboard'))
 
@@ -544,7 +782,7 @@ def generate_html_code(submissions):
         html += '        </div>\n'
         
         if sub.get("image_url"):
-            html += f'        <img src="{sub["image_url"]}" style="width: 180px; height: auto; border-radius: 8px;" alt="{sub["title"]}">\n'
+            html += f'        <img src="{image_proxy.thumbnail_url(sub, 180)}" srcset="{image_proxy.thumbnail_url(sub, 360)} 2x" width="180" style="width: 180px; height: auto; border-radius: 8px;" alt="{sub["title"]}">\n'
         
         html += '    </div>\n'
     
@@ -589,38 +827,11 @@ def admin_dashboard():
 
     session["last_active"] = time.time()
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT COUNT(*) as count FROM subscribers")
-    subscriber_count = cur.fetchone()['count']
-    
-    cur.execute("SELECT COUNT(*) as count FROM users WHERE status = 'pending'")
-    pending_users = cur.fetchone()['count']
-    
-    cur.execute("SELECT COUNT(*) as count FROM submissions WHERE status = 'pending'")
-    pending_submissions = cur.fetchone()['count']
-    
-    cur.execute("SELECT email FROM subscribers ORDER BY subscribed_at DESC")
-    subscribers = [row["email"] for row in cur.fetchall()]
-    
-    cur.execute("""
-        SELECT u.*, 
-               (SELECT COUNT(*) FROM submissions s WHERE s.user_id = u.id) as submission_count
-        FROM users u 
-        ORDER BY u.created_at DESC
-    """)
-    users = cur.fetchall()
-    
-    cur.execute("""
-        SELECT s.*, u.email as user_email, u.company_name 
-        FROM submissions s
-        JOIN users u ON s.user_id = u.id
-        ORDER BY s.created_at DESC
-    """)
-    submissions = cur.fetchall()
-    
-    cur.close()
+    conn = get_read_connection()
+    counts = queries.fetch_one(conn, "admin_counts")
+    subscribers = [row["email"] for row in queries.fetch_all(conn, "subscriber_emails")]
+    users = queries.fetch_all(conn, "admin_users")
+    submissions = queries.fetch_all(conn, "admin_submissions")
     conn.close()
 
     return render_template("admin/dashboard.html", 
@@ -628,43 +839,164 @@ def admin_dashboard():
                          users=users,
                          submissions=submissions,
                          stats={
-                             'subscriber_count': subscriber_count,
-                             'pending_users': pending_users,
-                             'pending_submissions': pending_submissions
+                             'subscriber_count': counts['subscriber_count'],
+                             'pending_users': counts['pending_users'],
+                             'pending_submissions': counts['pending_submissions']
                          })
 
+@app.route("/admin/search")
+def admin_search():
+    """Recherche dans toutes les soumissions, quel que soit leur statut"""
+    if not session.get("admin"):
+        return jsonify({"error": "Accès refusé"}), 403
+
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"results": [], "next": None})
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+
+    conn = get_read_connection()
+    rows, next_cursor = search_submissions(conn, query, published_only=False,
+                                           after=request.args.get("after"), limit=limit)
+    conn.close()
+
+    results = [{
+        "id": row["id"],
+        "title": row["title"],
+        "company_name": row["company_name"],
+        "category": row["category"],
+        "status": row["status"],
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+        "rank": row["rank"],
+    } for row in rows]
+    return jsonify({"results": results, "next": next_cursor})
+
 @app.route("/admin/generate_newsletter")
 def generate_newsletter():
     if not session.get("admin"):
         return redirect(url_for("admin_login"))
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT s.*, u.company_name 
-        FROM submissions s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.status = 'approved'
-        ORDER BY s.category, s.created_at DESC
-    """)
-    submissions = cur.fetchall()
-    
-    cur.close()
+    conn = get_read_connection()
+    submissions = queries.fetch_all(conn, "approved_submissions")
     conn.close()
     
     return render_template("admin/generate_newsletter.html", submissions=submissions)
 
+@app.route("/admin/jobs")
+def admin_jobs():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    conn = get_read_connection()
+    recent = jobs.recent_jobs(conn)
+    conn.close()
+
+    return render_template("admin/jobs.html", jobs=recent)
+
+@app.route("/admin/jobs/enqueue", methods=["POST"])
+def admin_enqueue_job():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    job_type = request.form.get("job_type")
+    if job_type == "send_newsletter":
+        payload, priority = {"provider": request.form.get("provider", "brevo")}, 10
+    elif job_type == "render_newsletter":
+        payload, priority = {}, 5
+    elif job_type == "import_subscribers":
+        upload = request.files.get("file")
+        content = upload.read().decode("utf-8-sig", errors="ignore") if upload else ""
+        # Première colonne de chaque ligne, en ignorant l'en-tête éventuel
+        emails = [line.split(",")[0].strip() for line in content.splitlines()]
+        payload, priority = {"emails": [e for e in emails if "@" in e]}, 0
+    else:
+        flash("Type de tâche inconnu", "danger")
+        return redirect(url_for("admin_jobs"))
+
+    conn = get_db_connection()
+    job_id = jobs.enqueue(conn, job_type, payload, priority=priority)
+    conn.commit()
+    conn.close()
+
+    flash(f"✅ Tâche #{job_id} ajoutée à la file", "success")
+    return redirect(url_for("admin_jobs"))
+
+@app.route("/admin/profiles")
+def admin_profiles():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    profiles = profiler.list_profiles()
+    for profile in profiles:
+        profile["created"] = datetime.fromtimestamp(profile["created_at"])
+    return render_template("admin/profiles.html", profiles=profiles,
+                           max_seconds=profiler.PROFILE_MAX_SECONDS,
+                           interval_ms=profiler.PROFILE_INTERVAL_MS)
+
+@app.route("/admin/profiles/start", methods=["POST"])
+def admin_start_profile():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    mode = request.form.get("mode", "duration")
+    route = request.form.get("route", "").strip()
+    if mode == "requests" and not route.startswith("/"):
+        flash("Indiquez la route à profiler (ex. /subscribe)", "danger")
+        return redirect(url_for("admin_profiles"))
+
+    profile_id = profiler.start_profile(
+        "requests" if mode == "requests" else "duration",
+        seconds=request.form.get("seconds", 30, type=int),
+        route=route,
+        requests=request.form.get("requests", 10, type=int),
+        interval_ms=request.form.get("interval_ms", profiler.PROFILE_INTERVAL_MS, type=float),
+    )
+    flash(f"🔬 Profil {profile_id} armé sur tous les workers", "success")
+    return redirect(url_for("admin_profiles"))
+
+@app.route("/admin/profiles/stop", methods=["POST"])
+def admin_stop_profile():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    profiler.stop_profile()
+    flash("Profil arrêté", "success")
+    return redirect(url_for("admin_profiles"))
+
+@app.route("/admin/profiles/<profile_id>")
+def admin_profile(profile_id):
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    loaded = profiler.load_profile(profile_id)
+    if loaded is None:
+        abort(404)
+    meta, stacks = loaded
+    return render_template("admin/profile.html", profile=meta,
+                           samples=sum(stacks.values()),
+                           top=profiler.top_functions(stacks),
+                           flamegraph=profiler.flamegraph_svg(stacks) if stacks else None)
+
+@app.route("/admin/profiles/<profile_id>.collapsed")
+def admin_profile_collapsed(profile_id):
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    loaded = profiler.load_profile(profile_id)
+    if loaded is None:
+        abort(404)
+    data = "".join(f"{stack} {count}\n" for stack, count in loaded[1].most_common())
+    return send_file(io.BytesIO(data.encode("utf-8")), mimetype="text/plain", as_attachment=True,
+                     download_name=f"profil-{profile_id}.collapsed")
+
 @app.route("/admin/approve_user/<int:user_id>", methods=["POST"])
 def approve_user(user_id):
     if not session.get("admin"):
         return redirect(url_for("admin_login"))
     
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET status = 'approved', approved_at = NOW() WHERE id = %s", (user_id,))
+    queries.execute(conn, "approve_user", user_id)
     conn.commit()
-    cur.close()
     conn.close()
     
     flash("✅ Utilisateur approuvé", "success")
@@ -676,10 +1008,8 @@ def reject_user(user_id):
         return redirect(url_for("admin_login"))
     
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET status = 'rejected' WHERE id = %s", (user_id,))
+    queries.execute(conn, "reject_user", user_id)
     conn.commit()
-    cur.close()
     conn.close()
     
     flash("❌ Utilisateur rejeté", "info")
@@ -691,11 +1021,10 @@ def approve_submission(submission_id):
         return redirect(url_for("admin_login"))
     
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE submissions SET status = 'approved' WHERE id = %s", (submission_id,))
+    queries.execute(conn, "approve_submission", submission_id)
     conn.commit()
-    cur.close()
     conn.close()
+    offer_cache.invalidate()
     
     flash("✅ Soumission approuvée", "success")
     return redirect(url_for("admin_dashboard"))
@@ -706,11 +1035,10 @@ def reject_submission(submission_id):
         return redirect(url_for("admin_login"))
     
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE submissions SET status = 'rejected' WHERE id = %s", (submission_id,))
+    queries.execute(conn, "reject_submission", submission_id)
     conn.commit()
-    cur.close()
     conn.close()
+    offer_cache.invalidate()
     
     flash("Soumission rejetée", "info")
     return redirect(url_for("admin_dashboard"))
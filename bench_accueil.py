@@ -0,0 +1,170 @@
+import time
+import logging
+import argparse
+import threading
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from werkzeug.serving import make_server
+import requests
+import app as newsletter_app
+
+# ==========================
+# 🏁 Test de charge de la page d'accueil : origine seule vs derrière un cache
+# ==========================
+# Lance l'application (origine) et un petit reverse proxy cache local qui
+# respecte Cache-Control (public, s-maxage), l'absence de Set-Cookie et
+# revalide avec If-None-Match, comme le ferait un CDN. On compte les requêtes
+# qui atteignent réellement Flask dans les deux configurations.
+#
+#   python bench_accueil.py --duration 10 --concurrency 16 --s-maxage 2
+
+
+class OriginCounter:
+    """Middleware WSGI qui compte les requêtes reçues par l'application"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.hits = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        def counting_start_response(status, headers, exc_info=None):
+            with self._lock:
+                self.hits += 1
+                if status.startswith("304"):
+                    self.not_modified += 1
+            return start_response(status, headers, exc_info)
+        return self.wsgi_app(environ, counting_start_response)
+
+
+def _max_age(cache_control):
+    directives = {}
+    for part in cache_control.split(","):
+        name, _, value = part.strip().partition("=")
+        directives[name.lower()] = value
+    if "public" not in directives or "s-maxage" not in directives:
+        return None
+    return int(directives["s-maxage"])
+
+
+class CachingProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    origin = None
+    cache = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            entry = self.cache.get(self.path)
+        if entry and time.time() < entry["expires"]:
+            return self._send(entry, "HIT")
+
+        conn = http.client.HTTPConnection(*self.origin)
+        headers = {"If-None-Match": entry["etag"]} if entry and entry["etag"] else {}
+        conn.request("GET", self.path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+
+        if response.status == 304 and entry:
+            entry["expires"] = time.time() + entry["max_age"]
+            return self._send(entry, "REVALIDATED")
+
+        fresh = {"status": response.status, "body": body, "etag": response.getheader("ETag"),
+                 "content_type": response.getheader("Content-Type", "text/html")}
+        max_age = _max_age(response.getheader("Cache-Control", ""))
+        if response.status == 200 and max_age and not response.getheader("Set-Cookie"):
+            fresh.update(max_age=max_age, expires=time.time() + max_age)
+            with self.lock:
+                self.cache[self.path] = fresh
+        return self._send(fresh, "MISS")
+
+    def _send(self, entry, status):
+        self.send_response(entry["status"])
+        self.send_header("Content-Type", entry["content_type"])
+        self.send_header("Content-Length", str(len(entry["body"])))
+        self.send_header("X-Cache", status)
+        self.end_headers()
+        self.wfile.write(entry["body"])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load(url, duration, concurrency):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = session.get(url, timeout=10)
+                response.raise_for_status()
+                local.append(time.perf_counter() - start)
+            except requests.RequestException:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rate": len(latencies) / duration,
+        "p50": latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        "p95": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requêtes sur l'origine avec et sans cache devant la page d'accueil")
+    parser.add_argument("--duration", type=float, default=5, help="durée de chaque phase (s)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--s-maxage", type=int, default=newsletter_app.HOME_CACHE_SECONDS,
+                        help="durée de cache partagé annoncée par la page (s)")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    newsletter_app.HOME_CACHE_SECONDS = args.s_maxage
+    counter = OriginCounter(newsletter_app.app.wsgi_app)
+    newsletter_app.app.wsgi_app = counter
+    origin = serve(make_server("127.0.0.1", 0, newsletter_app.app, threaded=True))
+    CachingProxyHandler.origin = ("127.0.0.1", origin.server_port)
+    proxy = serve(ThreadingHTTPServer(("127.0.0.1", 0), CachingProxyHandler))
+    proxy.daemon_threads = True
+
+    # Compteur d'abonnés chargé une fois avant les mesures
+    requests.get(f"http://127.0.0.1:{origin.server_port}/", timeout=30)
+
+    print(f"{'configuration':>14} | {'req/s':>7} | {'p50':>7} | {'p95':>7} | {'requêtes':>8} | {'origine':>7} | {'dont 304':>8}")
+    for label, port in (("origine seule", origin.server_port), ("avec cache", proxy.server_port)):
+        hits, not_modified = counter.hits, counter.not_modified
+        result = load(f"http://127.0.0.1:{port}/", args.duration, args.concurrency)
+        print(f"{label:>14} | {result['rate']:>7.0f} | {result['p50']:>5.1f}ms | {result['p95']:>5.1f}ms | "
+              f"{result['requests']:>8} | {counter.hits - hits:>7} | {counter.not_modified - not_modified:>8}"
+              + (f" ({result['errors']} erreurs)" if result["errors"] else ""))
+
+    origin.shutdown()
+    proxy.shutdown()
+
+
+if __name__ == "__main__":
+    main()
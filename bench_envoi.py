@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import resource
+import threading
+import tracemalloc
+import contextlib
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from newsletter_template import MimeBuilder
+from smtp_pool import SmtpPool
+from email_optimizer import optimize_edition
+
+# ==========================
+# 🏁 Banc d'essai de l'envoi (aucun email réel n'est envoyé)
+# ==========================
+# Génère N abonnés fictifs et envoie l'édition à un faux serveur SMTP ou à une
+# fausse API HTTP (Mailgun ou Brevo) lancés en local dans un process séparé.
+# Les faux fournisseurs simulent la latence, les erreurs temporaires et la
+# limitation de débit (429 / 421) pour comparer objectivement deux versions
+# du code d'envoi. En mode http, c'est le send_edition() des scripts de
+# production qui tourne, redirigé via MAILGUN_API_BASE / BREVO_API_BASE.
+#
+#   python bench_envoi.py smtp -n 2000 --latency 20 --error-rate 0.02 --rate 300
+#   python bench_envoi.py http --provider brevo -n 2000 --rate 100 --json
+#
+# Le faux serveur SMTP utilise aiosmtpd (pip install aiosmtpd).
+
+SENDER = "newsletter@bench.invalid"
+SUBJECT = "📰 Votre Newsletter Hebdo"
+
+
+class Throttle:
+    """Seau à jetons partagé : au-delà de `rate` messages/s, le fournisseur refuse"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def _count(counters, name):
+    # += sur un multiprocessing.Value n'est pas atomique entre threads
+    with counters[name].get_lock():
+        counters[name].value += 1
+
+
+def _delay(latency_ms):
+    """Latence simulée : moyenne `latency_ms`, +/- 50 %"""
+    return latency_ms * random.uniform(0.5, 1.5) / 1000 if latency_ms else 0
+
+
+# ==========================
+# 🎭 Faux fournisseurs (process séparé)
+# ==========================
+class FakeSmtpHandler:
+    def __init__(self, config, counters):
+        self.config = config
+        self.counters = counters
+        self.throttle = Throttle(config["rate"])
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(_delay(self.config["latency"]))
+        if not self.throttle.allow():
+            _count(self.counters, "throttled")
+            return "421 4.7.0 Trop de messages, réessayez plus tard"
+        if random.random() < self.config["error_rate"]:
+            _count(self.counters, "errors")
+            return "451 4.3.0 Erreur temporaire simulée"
+        _count(self.counters, "accepted")
+        return "250 OK"
+
+
+class FakeHttpHandler(BaseHTTPRequestHandler):
+    config = {}
+    counters = {}
+    throttle = None
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(_delay(self.config["latency"]))
+        if not self.throttle.allow():
+            _count(self.counters, "throttled")
+            self._reply(429, {"message": "Too many requests"}, {"Retry-After": "1"})
+        elif random.random() < self.config["error_rate"]:
+            _count(self.counters, "errors")
+            self._reply(503, {"message": "Erreur temporaire simulée"})
+        elif self.path.endswith("/smtp/email"):
+            # Brevo : POST /v3/smtp/email -> 201 {"messageId": ...}
+            _count(self.counters, "accepted")
+            self._reply(201, {"messageId": f"<{time.time_ns()}@bench.invalid>"})
+        else:
+            # Mailgun : POST /v3/<domaine>/messages -> 200
+            _count(self.counters, "accepted")
+            self._reply(200, {"id": f"<{time.time_ns()}@bench.invalid>", "message": "Queued. Thank you."})
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_fake_provider(kind, port, config, counters, ready):
+    if kind == "smtp":
+        from aiosmtpd.controller import Controller
+        controller = Controller(FakeSmtpHandler(config, counters), hostname="127.0.0.1", port=port)
+        controller.start()
+    else:
+        FakeHttpHandler.config = config
+        FakeHttpHandler.counters = counters
+        FakeHttpHandler.throttle = Throttle(config["rate"])
+        server = ThreadingHTTPServer(("127.0.0.1", port), FakeHttpHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ==========================
+# 📤 Envois mesurés (même chaîne que les scripts de production)
+# ==========================
+class FirstSend:
+    """Retient l'instant du premier envoi réussi"""
+
+    def __init__(self):
+        self.at = None
+        self._lock = threading.Lock()
+
+    def mark(self):
+        if self.at is None:
+            with self._lock:
+                if self.at is None:
+                    self.at = time.perf_counter()
+
+
+def bench_smtp(args, port, subscribers, html):
+    first = FirstSend()
+    edition = optimize_edition(html)
+    builder = MimeBuilder(edition["html"], SENDER, SUBJECT, text=edition["text"])
+
+    def on_result(recipient, error):
+        if error is None:
+            first.mark()
+
+    pool = SmtpPool("127.0.0.1", port, connections=args.connections, max_per_session=args.max_per_session,
+                    max_retries=args.max_retries, backoff=args.backoff, starttls=False)
+    stats = pool.send_all(SENDER, subscribers, builder.build, on_result=on_result)
+    return stats, first.at
+
+
+def bench_http(args, port, subscribers, html):
+    """Envoi par le send_edition() du script de production, redirigé vers le faux fournisseur"""
+    first = FirstSend()
+    base = f"http://127.0.0.1:{port}"
+    # Lu à l'import du script : à définir avant
+    os.environ["MAILGUN_API_BASE"] = base
+    os.environ["BREVO_API_BASE"] = f"{base}/v3"
+    if args.provider == "brevo":
+        import send_newsletter_brevo as script
+    else:
+        import send_newsletter_mailgun as script
+
+    def on_result(recipient, error):
+        if error is None:
+            first.mark()
+
+    send_start = time.perf_counter()
+    # Le rapport d'optimisation du script ne doit pas polluer la sortie --json
+    with contextlib.redirect_stdout(sys.stderr):
+        stats = script.send_edition(subscribers, html, on_result=on_result)
+    elapsed = time.perf_counter() - send_start
+    # Les scripts de production envoient en séquence et ne retentent pas
+    stats.update(retries=0, connections=None, elapsed=elapsed,
+                 rate=stats["sent"] / elapsed if elapsed else 0.0)
+    return stats, first.at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai de l'envoi de la newsletter (hors ligne)")
+    parser.add_argument("mode", choices=("smtp", "http"), help="chaîne SMTP (SmtpPool) ou API HTTP (scripts de production)")
+    parser.add_argument("--provider", choices=("mailgun", "brevo"), default="mailgun",
+                        help="script d'envoi HTTP mesuré (mode http)")
+    parser.add_argument("-n", "--subscribers", type=int, default=1000, help="nombre d'abonnés fictifs")
+    parser.add_argument("--html", default="email_newsletter.html", help="édition à envoyer")
+    parser.add_argument("--latency", type=float, default=20, help="latence moyenne du fournisseur (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="proportion d'erreurs temporaires (0-1)")
+    parser.add_argument("--rate", type=float, default=0, help="débit max accepté (msg/s, 0 = illimité)")
+    parser.add_argument("--connections", type=int, default=4, help="connexions SMTP en parallèle")
+    parser.add_argument("--max-per-session", type=int, default=90, help="messages par session SMTP")
+    parser.add_argument("--max-retries", type=int, default=3, help="nouvelles tentatives SMTP")
+    parser.add_argument("--backoff", type=float, default=0.2, help="délai de base entre deux tentatives SMTP (s)")
+    parser.add_argument("--tracemalloc", action="store_true", help="mesure aussi le pic d'allocations Python (plus lent)")
+    parser.add_argument("--json", action="store_true", help="affiche le résultat en JSON (comparaison de runs)")
+    args = parser.parse_args()
+
+    if args.mode == "smtp":
+        try:
+            import aiosmtpd  # noqa: F401
+        except ImportError:
+            sys.exit("Le faux serveur SMTP nécessite aiosmtpd : pip install aiosmtpd")
+
+    counters = {name: multiprocessing.Value("i", 0) for name in ("accepted", "errors", "throttled")}
+    config = {"latency": args.latency, "error_rate": args.error_rate, "rate": args.rate}
+    port = free_port()
+    ready = multiprocessing.Event()
+    provider = multiprocessing.Process(target=run_fake_provider, args=(args.mode, port, config, counters, ready),
+                                       daemon=True)
+    provider.start()
+    if not ready.wait(10):
+        sys.exit("Le faux fournisseur n'a pas démarré")
+
+    subscribers = [f"abonne{i}@bench.invalid" for i in range(args.subscribers)]
+    with open(args.html, "r", encoding="utf-8") as f:
+        html = f.read()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    run = bench_smtp if args.mode == "smtp" else bench_http
+    stats, first_at = run(args, port, subscribers, html)
+    total = time.perf_counter() - start
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+
+    provider.terminate()
+
+    result = {
+        "mode": args.mode,
+        "target": args.provider if args.mode == "http" else "smtp",
+        "subscribers": args.subscribers,
+        "sent": stats["sent"],
+        "failed": stats["failed"],
+        "retries": stats["retries"],
+        "connections": stats["connections"],
+        "msgs_per_s": round(stats["sent"] / total, 1) if total else 0.0,
+        "total_s": round(total, 3),
+        "first_send_ms": round((first_at - start) * 1000, 1) if first_at else None,
+        "peak_rss_mb": round(rss_peak / 1024, 1),  # ru_maxrss est en Ko sous Linux
+        "rss_growth_mb": round((rss_peak - rss_before) / 1024, 1),
+        "traced_peak_mb": round(traced_peak / 1024 / 1024, 1) if traced_peak is not None else None,
+        "provider": {name: value.value for name, value in counters.items()},
+        "config": config,
+    }
+
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    summary = (f"🏁 {result['target'].upper()} : {result['sent']}/{args.subscribers} envoyés, "
+               f"{result['failed']} échecs, {result['retries']} nouvelles tentatives")
+    if result["connections"] is not None:
+        summary += f" ({result['connections']} connexions)"
+    print(summary)
+    print(f"⚡ {result['msgs_per_s']} msg/s sur {result['total_s']} s, premier envoi après {result['first_send_ms']} ms")
+    memory = f"🧠 pic mémoire {result['peak_rss_mb']} Mo (+{result['rss_growth_mb']} Mo pendant l'envoi)"
+    if traced_peak is not None:
+        memory += f", allocations Python {result['traced_peak_mb']} Mo"
+    print(memory)
+    provider_counts = result["provider"]
+    print(f"🎭 fournisseur : {provider_counts['accepted']} acceptés, {provider_counts['errors']} erreurs simulées, "
+          f"{provider_counts['throttled']} refus pour débit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import os
+import re
+import time
+import threading
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+from flask import session, has_request_context
+from dotenv import load_dotenv
+
+# ==========================
+# 🗄️ Connexions PostgreSQL : primaire + réplique en lecture (optionnelle)
+# ==========================
+# Les écritures vont toujours sur DATABASE_URL. Les lectures passent par
+# get_read_connection() qui choisit la réplique (DATABASE_REPLICA_URL) sauf :
+# - si la session vient d'écrire (lecture de ses propres écritures),
+# - si la réplique est en retard ou injoignable (repli sur la primaire).
+#
+# Chaque base a un disjoncteur : après DB_BREAKER_FAILURES échecs de connexion
+# consécutifs, les appels échouent immédiatement (DatabaseUnavailable) pendant
+# DB_BREAKER_RESET secondes au lieu d'attendre le délai de connexion à chaque
+# requête. Une seule connexion d'essai passe ensuite pour tester le retour.
+#
+# Le worker de tâches (worker.py) a besoin d'une vraie session PostgreSQL :
+# verrous consultatifs, LISTEN et pg_backend_pid() n'ont pas de sens derrière
+# PgBouncer en mode transaction (URL Neon "-pooler"), où chaque transaction
+# peut tomber sur un autre backend. Il se connecte donc à DATABASE_DIRECT_URL.
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+DATABASE_DIRECT_URL = os.getenv("DATABASE_DIRECT_URL")
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE", "require")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # connexions gardées ouvertes par process
+POOL_IDLE_CHECK = 60  # au-delà (secondes d'inactivité), on vérifie la connexion avant usage
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))  # secondes (réveil Neon compris)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "3"))
+DB_BREAKER_RESET = float(os.getenv("DB_BREAKER_RESET", "30"))
+
+PIN_TO_PRIMARY_SECONDS = 5      # après une écriture, la session lit sur la primaire
+REPLICA_MAX_LAG_SECONDS = 2     # au-delà, on considère la réplique en retard
+LAG_CHECK_INTERVAL = 5          # secondes entre deux mesures du retard
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+"""
+
+_replica_state = {"healthy": True, "checked_at": 0}
+_replica_lock = threading.Lock()
+
+
+class DatabaseUnavailable(psycopg2.OperationalError):
+    """Base injoignable : disjoncteur ouvert, on n'essaie même pas de se connecter"""
+
+
+class CircuitBreaker:
+    def __init__(self, failures=DB_BREAKER_FAILURES, reset_after=DB_BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.time() - self.opened_at < self.reset_after:
+                raise DatabaseUnavailable("Base de données indisponible (disjoncteur ouvert)")
+            self.trial = True  # demi-ouvert : cet appel teste le retour de la base
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print("Base de données de nouveau joignable, disjoncteur refermé")
+            self.consecutive, self.opened_at, self.trial = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.trial or self.consecutive >= self.failures:
+                if self.opened_at is None or self.trial:
+                    print(f"Base de données injoignable, disjoncteur ouvert pour {self.reset_after:.0f}s")
+                self.opened_at, self.trial = time.time(), False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+def is_pooled_url(url):
+    """URL d'un PgBouncer en mode transaction (endpoint Neon "-pooler")"""
+    return "-pooler" in (url or "")
+
+
+def direct_database_url():
+    """URL sans pooler (DATABASE_DIRECT_URL, à défaut DATABASE_URL sans le suffixe Neon -pooler)"""
+    if DATABASE_DIRECT_URL:
+        return DATABASE_DIRECT_URL
+    return re.sub(r"-pooler(?=\.)", "", DATABASE_URL or "", count=1)
+
+
+def _connect_options(url):
+    options = {"sslmode": DATABASE_SSLMODE, "connect_timeout": DB_CONNECT_TIMEOUT,
+               "keepalives": 1, "keepalives_idle": 30}
+    # PgBouncer (URL Neon "-pooler") refuse le paramètre de démarrage "options" :
+    # la limite y vient du rôle (apply_role_statement_timeout)
+    if DB_STATEMENT_TIMEOUT_MS and not is_pooled_url(url):
+        options["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return options
+
+
+def apply_role_statement_timeout(conn):
+    """Pose DB_STATEMENT_TIMEOUT_MS comme valeur par défaut du rôle (appelé par init_db).
+
+    Le pooler refuse "options" à la connexion : c'est ce réglage qui limite la
+    durée des requêtes en production. Il vaut pour les nouvelles sessions serveur.
+    """
+    if not DB_STATEMENT_TIMEOUT_MS:
+        return
+    setting = f"statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT setconfig FROM pg_db_role_setting
+            WHERE setdatabase = 0 AND setrole = (SELECT oid FROM pg_roles WHERE rolname = CURRENT_USER)
+        """)
+        row = cur.fetchone()
+        if row is None or setting not in (row["setconfig"] or []):
+            cur.execute("ALTER ROLE CURRENT_USER SET statement_timeout = %s", (DB_STATEMENT_TIMEOUT_MS,))
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Impossible de fixer statement_timeout sur le rôle: {e}")
+    finally:
+        cur.close()
+
+
+class AppConnection(psycopg2.extensions.connection):
+    """Connexion qui retourne dans son pool à la fermeture.
+
+    Elle garde la liste des requêtes préparées côté serveur (voir queries.py),
+    qui restent donc valables d'une requête HTTP à l'autre.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.pool = None
+        self.released_at = time.time()
+
+    def close(self):
+        if self.pool is not None and not self.closed:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def discard(self):
+        psycopg2.extensions.connection.close(self)
+
+
+class ConnectionPool:
+    def __init__(self, url, size=DB_POOL_SIZE):
+        self.url = url
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.breaker = CircuitBreaker()
+
+    def acquire(self):
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Après un fork, les connexions héritées ne doivent pas être partagées
+                self._idle, self._pid = [], os.getpid()
+
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                break
+            if conn.closed:
+                continue
+            if time.time() - conn.released_at > POOL_IDLE_CHECK:
+                try:
+                    cur = conn.cursor()
+                    cur.execute("SELECT 1")
+                    cur.close()
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.discard()
+                    continue
+            return conn
+
+        self.breaker.before_call()
+        try:
+            conn = psycopg2.connect(self.url, cursor_factory=RealDictCursor, connection_factory=AppConnection,
+                                    **_connect_options(self.url))
+        except Exception:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        conn.pool = self
+        return conn
+
+    def release(self, conn):
+        try:
+            # Transaction laissée ouverte (lecture sans commit, erreur...) : on la termine
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            conn.discard()
+            return
+        conn.released_at = time.time()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+
+_pools = {}
+
+
+def _connect(url):
+    pool = _pools.get(url)
+    if pool is None:
+        pool = _pools.setdefault(url, ConnectionPool(url))
+    return pool.acquire()
+
+
+def get_db_connection():
+    """Connexion à la primaire (écritures et lectures qui doivent être à jour)"""
+    return _connect(DATABASE_URL)
+
+
+def get_direct_connection():
+    """Connexion à la primaire sans pooler (sessions du worker de tâches)"""
+    return _connect(direct_database_url())
+
+
+def pin_to_primary():
+    """À appeler après une écriture : la session relit ses données sur la primaire"""
+    if has_request_context():
+        session["primary_until"] = time.time() + PIN_TO_PRIMARY_SECONDS
+
+
+def _is_pinned():
+    return has_request_context() and session.get("primary_until", 0) > time.time()
+
+
+def _check_lag(conn):
+    """Mesure le retard de la réplique au plus toutes les LAG_CHECK_INTERVAL secondes"""
+    now = time.time()
+    with _replica_lock:
+        if now - _replica_state["checked_at"] < LAG_CHECK_INTERVAL:
+            return _replica_state["healthy"]
+        _replica_state["checked_at"] = now
+
+    cur = conn.cursor()
+    cur.execute(LAG_SQL)
+    lag = float(cur.fetchone()["lag"])
+    cur.close()
+    healthy = lag <= REPLICA_MAX_LAG_SECONDS
+    if not healthy:
+        print(f"Réplique en retard de {lag:.1f}s, lectures redirigées vers la primaire")
+    _replica_state["healthy"] = healthy
+    return healthy
+
+
+def get_read_connection(respect_pin=True):
+    """Connexion pour une lecture : réplique si possible, sinon primaire.
+
+    respect_pin=False pour les données communes à tous (compteurs...) : la
+    session n'est alors pas lue, ce qui évite "Vary: Cookie" sur les pages cacheables.
+    """
+    if not DATABASE_REPLICA_URL or (respect_pin and _is_pinned()):
+        return get_db_connection()
+    # Réplique déclarée en retard : on attend la prochaine mesure pour réessayer
+    if not _replica_state["healthy"] and time.time() - _replica_state["checked_at"] < LAG_CHECK_INTERVAL:
+        return get_db_connection()
+
+    try:
+        conn = _connect(DATABASE_REPLICA_URL)
+    except psycopg2.OperationalError as e:
+        print(f"Réplique injoignable, repli sur la primaire: {e}")
+        _replica_state.update(healthy=False, checked_at=time.time())
+        return get_db_connection()
+
+    try:
+        if _check_lag(conn):
+            return conn
+    except psycopg2.Error as e:
+        print(f"Erreur mesure du retard de la réplique: {e}")
+        _replica_state.update(healthy=False, checked_at=time.time())
+    conn.close()
+    return get_db_connection()
+
+
+# ==========================
+# 🧪 Simulation : base lente (réveil / trou noir) puis base arrêtée
+# ==========================
+if __name__ == "__main__":
+    import socket
+    from stale_cache import StaleCache
+
+    def blackhole():
+        """Accepte les connexions TCP sans jamais répondre (base qui ne se réveille pas)"""
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(50)
+        clients = []
+        threading.Thread(target=lambda: clients.extend(iter(lambda: server.accept()[0], None)), daemon=True).start()
+        return server.getsockname()[1]
+
+    def closed_port():
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    DB_CONNECT_TIMEOUT = 2
+    DATABASE_SSLMODE = "disable"
+    for label, port in (("base lente", blackhole()), ("base arrêtée", closed_port())):
+        pool = ConnectionPool(f"postgresql://u:p@127.0.0.1:{port}/db")
+        cache = StaleCache()
+        cache.set("subscriber_count", 1234)
+        cache.invalidate("subscriber_count")
+
+        def load_count():
+            conn = pool.acquire()
+            conn.close()
+            return 0
+
+        print(f"--- {label}")
+        for attempt in range(DB_BREAKER_FAILURES + 2):
+            start = time.perf_counter()
+            try:
+                pool.acquire()
+            except DatabaseUnavailable:
+                outcome = "refus immédiat (disjoncteur)"
+            except psycopg2.OperationalError as e:
+                outcome = f"échec : {str(e).strip().splitlines()[0]}"
+            print(f"connexion {attempt + 1} : {outcome} en {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        start = time.perf_counter()
+        value = cache.get("subscriber_count", load_count, ttl=300)
+        print(f"cache périmé : {value} servi en {(time.perf_counter() - start) * 1000:.2f} ms, "
+              f"rafraîchissement en arrière-plan")
+        time.sleep(0.1)
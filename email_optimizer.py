@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import hashlib
+import tempfile
+from html import unescape
+from html.parser import HTMLParser
+from dotenv import load_dotenv
+
+# ==========================
+# 🗜️ Optimisation du HTML d'une édition (une fois par édition)
+# ==========================
+# - styles inline normalisés (propriétés en double supprimées, espaces retirés)
+# - espaces et commentaires HTML supprimés
+# - version texte (text/plain) générée automatiquement
+# - budget de taille : Gmail tronque les messages au-delà d'environ 102 Ko
+# Le résultat est mis en cache sur disque, indexé par l'empreinte du HTML.
+
+load_dotenv()
+
+EMAIL_SIZE_BUDGET = int(os.getenv("EMAIL_SIZE_BUDGET_KB", "100")) * 1024
+EMAIL_CACHE_DIR = os.getenv("EMAIL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "newsletter_editions"))
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+STYLE_ATTR = re.compile(r'style\s*=\s*"([^"]*)"', re.IGNORECASE)
+COMMENT = re.compile(r"<!--(?!\[if)(?!<!\[endif).*?-->", re.DOTALL)
+# Les espaces avant une balise de bloc ne s'affichent pas : on peut les retirer
+BETWEEN_TAGS = re.compile(r">\s+<(?=/?(?:html|head|body|meta|title|style|table|tbody|thead|tr|td|th"
+                          r"|div|p|h[1-6]|ul|ol|li|br|center|!DOCTYPE)\b)", re.IGNORECASE)
+SPACES = re.compile(r"[ \t\r\n]+")
+PRESERVE = re.compile(r"(<(pre|textarea)\b.*?</\2>)", re.IGNORECASE | re.DOTALL)
+
+
+def compact_style(style):
+    """'color: #333; margin:0 ; color:#444;' -> 'color:#444;margin:0'"""
+    declarations = {}
+    for declaration in style.split(";"):
+        if ":" not in declaration:
+            continue
+        name, value = declaration.split(":", 1)
+        name = name.strip().lower()
+        # La dernière valeur gagne, comme dans le navigateur
+        declarations.pop(name, None)
+        declarations[name] = SPACES.sub(" ", value.strip())
+    return ";".join(f"{name}:{value}" for name, value in declarations.items())
+
+
+def minify_html(html):
+    # On met de côté les blocs dont les espaces comptent
+    preserved = []
+
+    def keep(match):
+        preserved.append(match.group(1))
+        return f"\x00{len(preserved) - 1}\x00"
+
+    html = PRESERVE.sub(keep, html)
+    html = COMMENT.sub("", html)
+    html = STYLE_ATTR.sub(lambda m: f'style="{compact_style(m.group(1))}"', html)
+    html = BETWEEN_TAGS.sub("><", html)
+    html = SPACES.sub(" ", html).strip()
+    return re.sub(r"\x00(\d+)\x00", lambda m: preserved[int(m.group(1))], html)
+
+
+class _TextExtractor(HTMLParser):
+    BLOCKS = {"p", "div", "tr", "table", "h1", "h2", "h3", "h4", "li", "br"}
+    SKIP = {"style", "script", "head", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.links = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+        if tag == "a":
+            self.links.append(dict(attrs).get("href"))
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skip = max(self.skip - 1, 0)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+        elif tag == "a" and self.links:
+            href = self.links.pop()
+            if href and href != "#" and not href.startswith("mailto:"):
+                self.parts.append(f" ({href})")
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(SPACES.sub(" ", data))
+
+
+def html_to_text(html):
+    """Version texte lisible : un bloc par ligne, liens entre parenthèses"""
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    lines = [line.strip() for line in unescape("".join(extractor.parts)).split("\n")]
+    text = re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+    return text.strip() + "\n"
+
+
+def optimize_edition(html, budget=EMAIL_SIZE_BUDGET):
+    """Retourne {"html", "text", "report"} ; lève PayloadTooLarge si le budget est dépassé"""
+    digest = hashlib.sha256(html.encode("utf-8")).hexdigest()
+    cache_path = os.path.join(EMAIL_CACHE_DIR, f"{digest}.json")
+
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            edition = json.load(f)
+    except (FileNotFoundError, ValueError):
+        optimized = minify_html(html)
+        before = len(html.encode("utf-8"))
+        after = len(optimized.encode("utf-8"))
+        text = html_to_text(optimized)
+        edition = {
+            "html": optimized,
+            "text": text,
+            "html_bytes": after,
+            "report": (f"HTML {before / 1024:.1f} Ko -> {after / 1024:.1f} Ko "
+                       f"(-{100 - after * 100 // max(before, 1)} %), "
+                       f"texte {len(text.encode('utf-8')) / 1024:.1f} Ko"),
+        }
+        os.makedirs(EMAIL_CACHE_DIR, exist_ok=True)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(edition, f)
+        os.replace(tmp, cache_path)
+
+    if edition["html_bytes"] > budget:
+        raise PayloadTooLarge(f"Édition trop lourde : {edition['html_bytes'] / 1024:.1f} Ko "
+                              f"pour un budget de {budget / 1024:.0f} Ko ({edition['report']})")
+    return edition
+
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "email_newsletter.html"
+    with open(path, "r", encoding="utf-8") as f:
+        result = optimize_edition(f.read(), budget=float("inf"))
+    print(result["report"])
+    print("-" * 40)
+    print(result["text"])
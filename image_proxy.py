@@ -0,0 +1,258 @@
+import io
+import os
+import time
+import fcntl
+import socket
+import hashlib
+import ipaddress
+import tempfile
+import threading
+import requests
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit
+from newsletter_template import SITE_URL
+from dotenv import load_dotenv
+
+# ==========================
+# 🖼️ Proxy d'images des soumissions + cache disque de miniatures
+# ==========================
+# Chaque image externe est téléchargée UNE fois, réduite en 180/360 px
+# (JPEG + WebP) et stockée dans un cache disque borné (LRU sur la date
+# d'accès). L'URL contient une empreinte de l'image d'origine : si le
+# commerçant change d'image, l'URL change, on peut donc servir en "immutable".
+#
+# L'URL d'origine est saisie par le commerçant : le serveur ne télécharge que
+# des adresses publiques (pas de loopback, réseau privé, 169.254.x.x...), et
+# chaque redirection est revérifiée avant d'être suivie.
+#
+# Après l'envoi d'une édition, des centaines de clients demandent la même
+# miniature en même temps : un verrou fichier (partagé par les workers
+# gunicorn) ne laisse qu'un téléchargement par image, les autres attendent le
+# résultat en cache. Une origine en échec est notée FAILURE_TTL secondes pour
+# ne pas être retéléchargée à chaque requête.
+
+load_dotenv()
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "newsletter_thumbs"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "200")) * 1024 * 1024
+MAX_SOURCE_BYTES = 10 * 1024 * 1024  # on refuse les originaux de plus de 10 Mo
+MAX_SOURCE_PIXELS = 16_000_000  # ~48 Mo une fois décodée en RGB ; au-delà on refuse
+MAX_REDIRECTS = 3
+FAILURE_TTL = 300  # secondes pendant lesquelles une origine en échec n'est pas retentée
+BUILD_LOCK_STRIPES = 64  # fichiers de verrou, partagés entre images (jamais supprimés)
+BLOCK_PRIVATE_ADDRESSES = True
+
+THUMB_WIDTHS = (180, 360)
+FORMATS = {
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+}
+
+
+def url_version(image_url):
+    """Empreinte courte de l'URL d'origine (change si l'image change)"""
+    return hashlib.sha1(image_url.encode("utf-8")).hexdigest()[:12]
+
+
+def thumbnail_url(submission, width=180, fmt="jpg"):
+    """URL absolue de la miniature d'une soumission (utilisable dans les emails)"""
+    return f"{SITE_URL}/img/{submission['id']}/{url_version(submission['image_url'])}/{width}.{fmt}"
+
+
+class ThumbnailCache:
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        """Chemin du fichier en cache (et le marque comme récemment utilisé)"""
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def read(self, name):
+        """Contenu du fichier en cache, ou None (évincé entre-temps)"""
+        path = self.get(name)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def building(self, version):
+        """Verrou exclusif entre threads et workers pour générer les miniatures d'une image"""
+        path = self.path(f"build-{int(version, 16) % BUILD_LOCK_STRIPES}.lock")
+        with open(path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def failure(self, version):
+        """Nature du dernier échec ("unsafe" ou "error") s'il date de moins de FAILURE_TTL"""
+        path = self.path(f"{version}.failed")
+        try:
+            if time.time() - os.stat(path).st_mtime < FAILURE_TTL:
+                with open(path, encoding="utf-8") as f:
+                    return f.read() or "error"
+        except FileNotFoundError:
+            pass
+        return None
+
+    def record_failure(self, version, kind):
+        self.put(f"{version}.failed", kind.encode("utf-8"))
+
+    def put(self, name, data):
+        path = self.path(name)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # atomique : jamais de fichier à moitié écrit
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        # Les verrous ne sont jamais évincés : un worker peut être en attente dessus
+        return [e for e in os.scandir(self.directory)
+                if e.is_file() and not e.name.endswith((".tmp", ".lock"))]
+
+    def _scan_size(self):
+        return sum(e.stat().st_size for e in self._entries())
+
+    def _evict(self):
+        # Les autres workers écrivent aussi : on repart de l'état réel du disque
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        size = sum(e.stat().st_size for e in entries)
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if size <= target:
+                break
+            try:
+                size -= entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self._size = size
+
+
+def cache_name(version, width, fmt):
+    return f"{version}-{width}.{fmt}"
+
+
+class UnsafeImageUrl(ValueError):
+    """URL d'origine refusée (schéma, hôte interne, trop de redirections)"""
+
+
+class SourceUnavailable(Exception):
+    """L'origine a échoué il y a moins de FAILURE_TTL secondes : pas de nouvel essai"""
+
+
+def check_source_url(image_url):
+    """Refuse les URL qui ne sont pas http(s) ou dont l'hôte résout vers une adresse non publique"""
+    parts = urlsplit(image_url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeImageUrl(f"URL d'image non autorisée : {image_url}")
+    if not BLOCK_PRIVATE_ADDRESSES:
+        return
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or 80, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as e:
+        raise UnsafeImageUrl(f"Hôte introuvable : {parts.hostname}") from e
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global:
+            raise UnsafeImageUrl(f"Adresse interne refusée : {parts.hostname} -> {address}")
+
+
+def fetch_source(image_url):
+    """Télécharge l'image d'origine en limitant sa taille (redirections revérifiées)"""
+    for _ in range(MAX_REDIRECTS + 1):
+        check_source_url(image_url)
+        with requests.get(image_url, stream=True, timeout=(3, 10), allow_redirects=False) as response:
+            if response.is_redirect:
+                image_url = urljoin(image_url, response.headers["Location"])
+                continue
+            response.raise_for_status()
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data.extend(chunk)
+                if len(data) > MAX_SOURCE_BYTES:
+                    raise ValueError("Image d'origine trop volumineuse")
+        return bytes(data)
+    raise UnsafeImageUrl("Trop de redirections")
+
+
+def build_thumbnails(cache, image_url):
+    """Génère et met en cache toutes les tailles/formats à partir d'un seul téléchargement
+
+    Retourne {nom: octets} pour servir la réponse même si le cache a déjà évincé le fichier.
+    """
+    from PIL import Image, ImageOps
+
+    source = Image.open(io.BytesIO(fetch_source(image_url)))
+    # Image.open ne lit que l'en-tête : on refuse avant de décoder les pixels
+    if source.width * source.height > MAX_SOURCE_PIXELS:
+        raise ValueError(f"Image d'origine trop grande ({source.width}x{source.height})")
+    # JPEG : décodage directement à l'échelle 1/2, 1/4 ou 1/8 si la miniature le permet
+    source.draft("RGB", (max(THUMB_WIDTHS), max(THUMB_WIDTHS)))
+    source = ImageOps.exif_transpose(source).convert("RGB")
+    version = url_version(image_url)
+    variants = {}
+
+    for width in THUMB_WIDTHS:
+        image = source.copy()
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+        for fmt, (pil_format, _, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, pil_format, **options)
+            name = cache_name(version, width, fmt)
+            variants[name] = buffer.getvalue()
+            cache.put(name, variants[name])
+    return variants
+
+
+def get_thumbnail(cache, image_url, name):
+    """Octets de la miniature `name`, générée au plus une fois à la fois par image.
+
+    Les requêtes concurrentes attendent le verrou puis trouvent le résultat en
+    cache. Un échec est mémorisé et relevé tel quel (UnsafeImageUrl ou
+    SourceUnavailable) jusqu'à expiration de FAILURE_TTL.
+    """
+    version = url_version(image_url)
+    with cache.building(version):
+        failure = cache.failure(version)
+        if failure == "unsafe":
+            raise UnsafeImageUrl(f"URL refusée récemment : {image_url}")
+        if failure:
+            raise SourceUnavailable(f"Origine en échec récent : {image_url}")
+        data = cache.read(name)
+        if data is not None:
+            return data
+        try:
+            return build_thumbnails(cache, image_url)[name]
+        except UnsafeImageUrl:
+            cache.record_failure(version, "unsafe")
+            raise
+        except Exception:
+            cache.record_failure(version, "error")
+            raise
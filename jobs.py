@@ -0,0 +1,155 @@
+import json
+import zlib
+import queries
+
+# ==========================
+# 🧵 File de tâches PostgreSQL (FOR UPDATE SKIP LOCKED)
+# ==========================
+# Les routes web n'exécutent plus les traitements lourds : elles insèrent une
+# ligne dans `jobs` et rendent la main. Le process `worker` (voir Procfile)
+# réclame les tâches avec SKIP LOCKED, par priorité, et gère les nouvelles
+# tentatives avec un délai exponentiel.
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+# Nombre maximum de tâches simultanées par type, tous workers confondus
+JOB_CONCURRENCY = {
+    "send_newsletter": 1,
+    "render_newsletter": 2,
+    "import_subscribers": 1,
+}
+
+# Tentatives par défaut, sauf pour les tâches non idempotentes : un envoi
+# interrompu à mi-parcours et relancé renverrait l'édition aux premiers abonnés
+DEFAULT_MAX_ATTEMPTS = 3
+JOB_MAX_ATTEMPTS = {
+    "send_newsletter": 1,
+}
+
+RETRY_BASE_DELAY = 30  # secondes, doublé à chaque tentative
+
+CREATE_TABLE_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id BIGSERIAL PRIMARY KEY,
+        job_type TEXT NOT NULL,
+        payload JSONB NOT NULL DEFAULT '{}',
+        priority INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        run_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        locked_at TIMESTAMP,
+        locked_by TEXT,
+        locked_pid INTEGER,
+        last_error TEXT,
+        result TEXT,
+        created_at TIMESTAMP DEFAULT NOW(),
+        finished_at TIMESTAMP
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS jobs_queued_idx ON jobs (priority DESC, run_at)
+        WHERE status = 'queued'
+    """,
+    # Tables créées avant la détection des workers perdus par leur session
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_attribute
+                       WHERE attrelid = 'jobs'::regclass AND attname = 'locked_pid' AND NOT attisdropped) THEN
+            ALTER TABLE jobs ADD COLUMN locked_pid INTEGER;
+        END IF;
+    END $$
+    """,
+]
+
+
+def init_jobs(cur):
+    for sql in CREATE_TABLE_SQL:
+        cur.execute(sql)
+
+
+def enqueue(conn, job_type, payload=None, priority=0, max_attempts=None):
+    """Ajoute une tâche et réveille les workers (LISTEN jobs) au commit"""
+    if max_attempts is None:
+        max_attempts = JOB_MAX_ATTEMPTS.get(job_type, DEFAULT_MAX_ATTEMPTS)
+    job_id = queries.fetch_one(conn, "enqueue_job", job_type, json.dumps(payload or {}),
+                               priority, max_attempts)["id"]
+    queries.fetch_one(conn, "notify_jobs")
+    return job_id
+
+
+def _slot_key(job_type):
+    return zlib.crc32(job_type.encode("utf-8")) & 0x7FFFFFFF
+
+
+def acquire_slot(conn, job_type):
+    """Prend un des N verrous consultatifs du type ; None si tous sont pris.
+
+    Les verrous sont liés à la session : si le worker meurt, ils sont libérés.
+    """
+    for slot in range(JOB_CONCURRENCY.get(job_type, 1)):
+        if queries.fetch_one(conn, "try_job_slot", _slot_key(job_type), slot)["ok"]:
+            return slot
+    return None
+
+
+def release_slot(conn, job_type, slot):
+    queries.fetch_one(conn, "release_job_slot", _slot_key(job_type), slot)
+
+
+def claim(conn, worker, job_types):
+    """Réclame la tâche prioritaire d'un type dont un créneau est libre"""
+    slots = {}
+    for job_type in job_types:
+        slot = acquire_slot(conn, job_type)
+        if slot is not None:
+            slots[job_type] = slot
+    conn.commit()
+
+    job = None
+    if slots:
+        job = queries.fetch_one(conn, "claim_job", worker, list(slots))
+        conn.commit()
+
+    # On ne garde que le créneau du type réellement obtenu
+    for job_type, slot in slots.items():
+        if not job or job["job_type"] != job_type:
+            release_slot(conn, job_type, slot)
+    conn.commit()
+    if job:
+        job["slot"] = slots[job["job_type"]]
+    return job
+
+
+def complete(conn, job, result=""):
+    queries.execute(conn, "complete_job", result, job["id"])
+    release_slot(conn, job["job_type"], job["slot"])
+    conn.commit()
+
+
+def fail(conn, job, error):
+    """Replanifie avec un délai exponentiel, ou marque en échec définitif"""
+    if job["attempts"] < job["max_attempts"]:
+        delay = RETRY_BASE_DELAY * 2 ** (job["attempts"] - 1)
+        queries.execute(conn, "retry_job", error, delay, job["id"])
+    else:
+        queries.execute(conn, "fail_job", error, job["id"])
+    release_slot(conn, job["job_type"], job["slot"])
+    conn.commit()
+
+
+def requeue_stale(conn):
+    """Reprend les tâches dont le worker a disparu en cours d'exécution.
+
+    Un worker vivant garde le verrou consultatif de son créneau sur la session
+    qui a réclamé la tâche (locked_pid) : une tâche "running" dont la session
+    ne tient plus aucun verrou est perdue, quelle que soit sa durée. Elle est
+    remise en file s'il lui reste des tentatives, sinon marquée en échec (un
+    envoi de newsletter n'est jamais relancé automatiquement).
+    """
+    return queries.execute(conn, "requeue_lost_jobs")
+
+
+def recent_jobs(conn, limit=100):
+    return queries.fetch_all(conn, "recent_jobs", limit)
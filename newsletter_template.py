@@ -0,0 +1,178 @@
+import os
+import re
+import time
+import quopri
+import uuid
+from email.header import Header
+from email.utils import formatdate, make_msgid
+from itsdangerous import URLSafeSerializer
+from dotenv import load_dotenv
+
+# ==========================
+# ✂️ Édition pré-découpée (segments fixes + emplacements personnalisés)
+# ==========================
+# Une édition est compilée UNE fois : le HTML est découpé autour des
+# emplacements {{ nom }} et chaque segment fixe est encodé (quoted-printable)
+# une seule fois. Pour chaque abonné, on ne fait plus qu'une concaténation
+# d'octets avec les quelques valeurs personnelles (lien de désinscription...).
+
+SLOT_PATTERN = re.compile(r"\{\{\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*\}\}")
+
+load_dotenv()
+
+SITE_URL = os.getenv("SITE_URL", "https://la-newsletter-aurillac.fr")
+SECRET_KEY = os.getenv("SECRET_KEY", "cle_secrete_par_defaut_123456")
+
+_serializer = URLSafeSerializer(SECRET_KEY, salt="unsubscribe")
+
+
+def make_unsubscribe_token(email):
+    """Jeton signé identifiant l'abonné dans le lien de désinscription"""
+    return _serializer.dumps(email)
+
+
+def read_unsubscribe_token(token):
+    """Retourne l'email contenu dans le jeton, ou None s'il est invalide"""
+    try:
+        return _serializer.loads(token)
+    except Exception:
+        return None
+
+
+def recipient_values(email):
+    """Valeurs par défaut des emplacements pour un abonné"""
+    token = make_unsubscribe_token(email)
+    return {
+        "email": email,
+        "unsubscribe_url": f"{SITE_URL}/unsubscribe/{token}",
+        "tracking_token": token,
+    }
+
+
+def _qp(data):
+    """Encode en quoted-printable puis termine par un saut de ligne 'doux'.
+
+    Le '=\\r\\n' final disparaît au décodage : deux morceaux encodés
+    séparément peuvent donc être concaténés tels quels.
+    """
+    encoded = quopri.encodestring(data).replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+    if encoded.endswith(b"\r\n") and not encoded.endswith(b"=\r\n"):
+        # quopri conserve les vrais sauts de ligne : on garde le dernier tel quel
+        return encoded
+    return encoded + b"=\r\n"
+
+
+class CompiledEdition:
+    """HTML d'une édition découpé en segments fixes et emplacements"""
+
+    def __init__(self, html):
+        self.segments = []
+        self.slots = []
+        position = 0
+        for match in SLOT_PATTERN.finditer(html):
+            self.segments.append(html[position:match.start()])
+            self.slots.append(match.group(1))
+            position = match.end()
+        self.segments.append(html[position:])
+
+        # Encodage unique des parties communes
+        self.encoded_segments = [_qp(s.encode("utf-8")) for s in self.segments]
+
+    def render(self, values):
+        """Version texte personnalisée (pour les API HTTP Brevo / Mailgun)"""
+        parts = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            parts.append(str(values.get(slot, "")))
+            parts.append(segment)
+        return "".join(parts)
+
+    def render_encoded(self, values):
+        """Corps quoted-printable personnalisé, par simple concaténation"""
+        parts = [self.encoded_segments[0]]
+        for slot, segment in zip(self.slots, self.encoded_segments[1:]):
+            parts.append(_qp(str(values.get(slot, "")).encode("utf-8")))
+            parts.append(segment)
+        return b"".join(parts)
+
+
+class MimeBuilder:
+    """Construit les messages MIME d'une édition avec en-têtes pré-encodés"""
+
+    def __init__(self, html, sender, subject, text=None):
+        self.edition = CompiledEdition(html)
+        self.text_edition = CompiledEdition(text) if text else None
+        self.sender = sender
+        self.boundary = "==" + uuid.uuid4().hex
+        self.domain = sender.split("@")[-1]
+
+        # En-têtes communs encodés une seule fois
+        self.static_headers = (
+            f"Subject: {Header(subject, 'utf-8').encode()}\r\n"
+            f"From: {sender}\r\n"
+            "MIME-Version: 1.0\r\n"
+            f'Content-Type: multipart/alternative; boundary="{self.boundary}"\r\n'
+        ).encode("ascii")
+        self.part_header = (
+            f"\r\n--{self.boundary}\r\n"
+            'Content-Type: text/html; charset="utf-8"\r\n'
+            "Content-Transfer-Encoding: quoted-printable\r\n\r\n"
+        ).encode("ascii")
+        self.text_part_header = (
+            f"\r\n--{self.boundary}\r\n"
+            'Content-Type: text/plain; charset="utf-8"\r\n'
+            "Content-Transfer-Encoding: quoted-printable\r\n\r\n"
+        ).encode("ascii")
+        self.closing = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+
+    def build(self, recipient, values=None):
+        """Message complet (octets) prêt pour smtplib.sendmail"""
+        if values is None:
+            values = recipient_values(recipient)
+        headers = (
+            f"To: {recipient}\r\n"
+            f"Date: {formatdate(localtime=True)}\r\n"
+            f"Message-ID: {make_msgid(domain=self.domain)}\r\n"
+        ).encode("utf-8")
+        if "unsubscribe_url" in values:
+            # Désinscription en un clic (RFC 8058) : le client mail POST sur l'URL
+            headers += (f"List-Unsubscribe: <{values['unsubscribe_url']}>\r\n"
+                        "List-Unsubscribe-Post: List-Unsubscribe=One-Click\r\n").encode("utf-8")
+        parts = [self.static_headers, headers]
+        if self.text_edition:
+            # La version texte vient en premier (les clients préfèrent la dernière)
+            parts += [self.text_part_header, self.text_edition.render_encoded(values)]
+        parts += [self.part_header, self.edition.render_encoded(values), self.closing]
+        return b"".join(parts)
+
+
+# ==========================
+# ⏱️ Micro-benchmark : coût par message selon la taille du HTML
+# ==========================
+if __name__ == "__main__":
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
+    card = '<div style="border: 1px solid #ddd; padding: 20px;"><h4>Offre é</h4><p>' + "x" * 400 + "</p></div>\n"
+    iterations = 200
+
+    print(f"{'taille HTML':>12} | {'MIMEMultipart':>14} | {'pré-découpé':>12}")
+    for cards in (10, 100, 1000):
+        html = card * cards + '<a href="{{ unsubscribe_url }}">Se désinscrire</a>'
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            msg = MIMEMultipart("alternative")
+            msg["Subject"] = "📰 Votre Newsletter Hebdo"
+            msg["From"] = "newsletter@example.org"
+            msg["To"] = f"abonne{i}@example.org"
+            msg.attach(MIMEText(html.replace("{{ unsubscribe_url }}", "#"), "html"))
+            msg.as_string()
+        legacy = (time.perf_counter() - start) / iterations
+
+        builder = MimeBuilder(html, "newsletter@example.org", "📰 Votre Newsletter Hebdo")
+        start = time.perf_counter()
+        for i in range(iterations):
+            builder.build(f"abonne{i}@example.org")
+        compiled = (time.perf_counter() - start) / iterations
+
+        print(f"{len(html):>10} o | {legacy * 1e6:>11.0f} µs | {compiled * 1e6:>9.0f} µs")
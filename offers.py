@@ -0,0 +1,197 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from datetime import datetime
+from email.utils import format_datetime
+from xml.sax.saxutils import escape
+from flask import request, make_response
+from newsletter_template import SITE_URL
+from image_proxy import thumbnail_url
+from dotenv import load_dotenv
+
+# ==========================
+# 📡 Offres publiées : API JSON et flux RSS mis en cache
+# ==========================
+# Les réponses sont sérialisées une seule fois puis gardées en mémoire avec leur
+# version gzip et leur ETag : un client qui interroge régulièrement reçoit un
+# 304 (ou des octets déjà compressés) sans requête SQL ni encodage.
+#
+# La modération (approbation, refus, modification, suppression) appelle
+# invalidate(), qui vide le cache du worker et touche un fichier de génération
+# relu par les autres workers au plus une fois par seconde. OFFERS_CACHE_SECONDS
+# borne l'âge des réponses dans tous les cas.
+
+load_dotenv()
+
+OFFERS_CACHE_SECONDS = int(os.getenv("OFFERS_CACHE_SECONDS", "300"))
+OFFERS_CACHE_ENTRIES = 256
+OFFERS_MAX_LIMIT = 100
+FEED_SIZE = 50
+GENERATION_FILE = os.path.join(tempfile.gettempdir(), "newsletter_offers.generation")
+GENERATION_CHECK_INTERVAL = 1.0
+CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+
+# Pagination par (created_at, id) décroissants sur les seules offres publiées
+INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS submissions_offers_idx ON submissions (created_at DESC, id DESC)
+        WHERE status IN ('approved', 'published')
+"""
+
+
+def make_cursor(row):
+    return f"{row['created_at'].strftime(CURSOR_FORMAT)}:{row['id']}"
+
+
+def parse_cursor(value):
+    """'20251019183000123456:42' -> (datetime, 42) ; (None, None) si absent ou invalide"""
+    try:
+        created_at, offer_id = value.split(":")
+        return datetime.strptime(created_at, CURSOR_FORMAT), int(offer_id)
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def serialize_offer(row):
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "description": row["description"],
+        "category": row["category"],
+        "company_name": row["company_name"],
+        "link_url": row["link_url"] or None,
+        "image_url": thumbnail_url(row, 360) if row["image_url"] else None,
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+    }
+
+
+def offers_json(rows, limit):
+    """Page JSON ; `rows` contient une ligne de plus que `limit` s'il reste des offres"""
+    page = rows[:limit]
+    next_cursor = make_cursor(page[-1]) if len(rows) > limit else None
+    body = {"offers": [serialize_offer(row) for row in page], "next": next_cursor}
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def feed_xml(rows, category=None):
+    """Flux RSS 2.0 des dernières offres"""
+    title = "Les bons plans de la Newsletter d'Aurillac" + (f" — {category}" if category else "")
+    items = []
+    for row in rows:
+        link = row["link_url"] or f"{SITE_URL}/newsletter"
+        description = row["description"]
+        if row["image_url"]:
+            description = f'<img src="{thumbnail_url(row, 360)}" alt=""><br>{description}'
+        pub_date = f"<pubDate>{format_datetime(row['created_at'])}</pubDate>" if row["created_at"] else ""
+        items.append(
+            "<item>"
+            f"<title>{escape(row['company_name'] or '')} : {escape(row['title'])}</title>"
+            f"<link>{escape(link)}</link>"
+            f'<guid isPermaLink="false">{escape(SITE_URL)}/offres/{row["id"]}</guid>'
+            f"<category>{escape(row['category'] or '')}</category>"
+            f"<description>{escape(description)}</description>"
+            f"{pub_date}"
+            "</item>"
+        )
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom"><channel>'
+        f"<title>{escape(title)}</title>"
+        f"<link>{escape(SITE_URL)}/</link>"
+        f'<atom:link href="{escape(SITE_URL)}/feed.xml" rel="self" type="application/rss+xml"/>'
+        "<description>Les offres des commerçants d'Aurillac</description>"
+        "<language>fr-fr</language>"
+        f"{''.join(items)}"
+        "</channel></rss>"
+    )
+    return xml.encode("utf-8")
+
+
+class Payload:
+    """Corps prêt à servir : octets bruts, version gzip et ETag"""
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6, mtime=0)
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.content_type = content_type
+        self.created_at = time.time()
+
+
+class PayloadCache:
+    def __init__(self, max_entries=OFFERS_CACHE_ENTRIES, ttl=OFFERS_CACHE_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = {}
+        self._version = 0  # incrémenté à chaque vidage : une construction en cours est alors jetée
+        self._lock = threading.Lock()
+        self._generation = self._read_generation()
+        self._checked_at = time.monotonic()
+
+    @staticmethod
+    def _read_generation():
+        try:
+            return os.stat(GENERATION_FILE).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if now - self._checked_at < GENERATION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        generation = self._read_generation()
+        if generation != self._generation:
+            self._generation = generation
+            self._entries.clear()
+            self._version += 1
+
+    def get(self, key, build, content_type):
+        """Payload en cache pour `key`, sinon construit via `build()` (octets)"""
+        with self._lock:
+            self._check_generation()
+            payload = self._entries.get(key)
+            if payload is not None and time.time() - payload.created_at < self.ttl:
+                return payload
+            version = self._version
+
+        payload = Payload(build(), content_type)
+        with self._lock:
+            if version != self._version:
+                return payload
+            if len(self._entries) >= self.max_entries:
+                # Les plus anciennes d'abord (dict ordonné par insertion)
+                for old_key in list(self._entries)[:self.max_entries // 4]:
+                    del self._entries[old_key]
+            self._entries[key] = payload
+        return payload
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._version += 1
+            with open(GENERATION_FILE, "a"):
+                os.utime(GENERATION_FILE)
+            self._generation = self._read_generation()
+
+
+def payload_response(payload, max_age=60):
+    """Réponse avec ETag/304 et corps gzip précalculé si le client l'accepte"""
+    if request.if_none_match.contains_weak(payload.etag):
+        response = make_response("", 304)
+    elif "gzip" in request.accept_encodings:
+        response = make_response(payload.gzipped)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = make_response(payload.body)
+    if response.status_code == 200:
+        response.headers["Content-Type"] = payload.content_type
+    # Même ETag pour les deux encodages : il est donc faible
+    response.set_etag(payload.etag, weak=True)
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
@@ -0,0 +1,436 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import zlib
+import tempfile
+import threading
+from html import escape
+from collections import Counter
+from dotenv import load_dotenv
+
+# ==========================
+# 🔬 Profilage par échantillonnage (admin et ligne de commande)
+# ==========================
+# Un thread relève la pile des autres threads toutes les PROFILE_INTERVAL_MS
+# (sys._current_frames) et compte les piles "repliées" (format collapsed de
+# flamegraph.pl / speedscope). Le coût est borné : intervalle minimal, durée
+# maximale, nombre de piles distinctes et profondeur limités.
+#
+# Sous gunicorn, chaque worker est un process : l'admin arme un profil dans un
+# fichier de contrôle (PROFILE_DIR/active.json) que chaque worker relit au plus
+# une fois par seconde. Chaque worker écrit ses propres piles, fusionnées à
+# l'affichage. En mode "requêtes", la limite N s'applique par worker.
+#
+#   python profiler.py send_newsletter_brevo.py            # profil d'un script
+#   python profiler.py -i 5 -o envoi.collapsed --svg envoi.svg send_newsletter.py
+
+load_dotenv()
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "newsletter_profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "20000"))  # piles distinctes gardées en mémoire
+MIN_INTERVAL = 0.001
+MAX_DEPTH = 128
+CONTROL_CHECK_INTERVAL = 1.0
+CONTROL_FILE = os.path.join(PROFILE_DIR, "active.json")
+OVERFLOW_STACK = "[piles non conservées]"
+PROFILE_ID = re.compile(r"[0-9a-f]{12}")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_labels = {}
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        if filename.startswith(ROOT + os.sep):
+            filename = os.path.relpath(filename, ROOT)
+        else:
+            # Bibliothèques : dossier parent + fichier (flask/app.py, pas app.py)
+            filename = os.path.join(*filename.split(os.sep)[-2:])
+        label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+        _labels[code] = label
+    return label
+
+
+def collapse(frame):
+    """Pile d'appels 'racine;...;feuille' (les frames les plus profondes sont gardées)"""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """Relève périodiquement les piles des threads du process"""
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS, max_stacks=PROFILE_MAX_STACKS, threads=None):
+        self.interval = max(interval_ms / 1000, MIN_INTERVAL)
+        self.max_stacks = max_stacks
+        # None : tous les threads (sauf l'échantillonneur) ; sinon identifiants à suivre
+        self.threads = threads
+        self.stacks = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self.cost = 0.0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        start = time.perf_counter()
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own or (self.threads is not None and ident not in self.threads):
+                continue
+            stack = collapse(frame)
+            if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                stack = OVERFLOW_STACK
+                self.dropped += 1
+            self.stacks[stack] += 1
+            self.samples += 1
+        self.cost += time.perf_counter() - start
+
+    def _run(self, seconds, should_stop, on_done):
+        started = time.perf_counter()
+        deadline = time.monotonic() + seconds if seconds else float("inf")
+        next_check = 0
+        while not self._stop.wait(self.interval):
+            self.sample()
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if should_stop and now >= next_check:
+                next_check = now + CONTROL_CHECK_INTERVAL
+                if should_stop():
+                    break
+        self.elapsed = time.perf_counter() - started
+        if on_done:
+            on_done(self)
+
+    def start(self, seconds=None, should_stop=None, on_done=None):
+        self._thread = threading.Thread(target=self._run, args=(seconds, should_stop, on_done),
+                                        name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if wait and self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def overhead(self):
+        """Part du temps passée à échantillonner (GIL tenu pendant ce temps)"""
+        return self.cost / self.elapsed if self.elapsed else 0.0
+
+
+# ==========================
+# 📊 Exploitation des piles : fichier collapsed, top des fonctions, flamegraph
+# ==========================
+def write_collapsed(path, stacks):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    os.replace(tmp, path)
+
+
+def read_collapsed(path, stacks=None):
+    stacks = Counter() if stacks is None else stacks
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+
+def top_functions(stacks, limit=30):
+    """Fonctions triées par temps propre (feuille de la pile), avec le temps cumulé"""
+    total = sum(stacks.values()) or 1
+    own, cumulative = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for name in set(frames):
+            cumulative[name] += count
+    return [{
+        "function": name,
+        "self": count,
+        "self_pct": 100 * count / total,
+        "total": cumulative[name],
+        "total_pct": 100 * cumulative[name] / total,
+    } for name, count in own.most_common(limit)]
+
+
+def _tree(stacks):
+    root = {"name": "tout", "value": 0, "children": {}}
+    for stack, count in stacks.items():
+        root["value"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"name": name, "value": 0, "children": {}})
+            node["value"] += count
+    return root
+
+
+def flamegraph_svg(stacks, width=1200, row=17, min_width=0.5):
+    """Flamegraph SVG autonome (racine en bas, largeur proportionnelle aux échantillons)"""
+    root = _tree(stacks)
+    total = root["value"] or 1
+    scale = width / total
+    rects = []
+    depth_max = 0
+
+    def layout(node, x, depth):
+        nonlocal depth_max
+        w = node["value"] * scale
+        if w < min_width:
+            return
+        depth_max = max(depth_max, depth)
+        rects.append((node, x, depth, w))
+        for child in sorted(node["children"].values(), key=lambda c: c["name"]):
+            layout(child, x, depth + 1)
+            x += child["value"] * scale
+
+    layout(root, 0, 0)
+    height = (depth_max + 1) * row
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}" font-family="Verdana, sans-serif" font-size="11">']
+    for node, x, depth, w in rects:
+        y = height - (depth + 1) * row
+        hue = zlib.crc32(node["name"].encode("utf-8")) % 40  # teintes chaudes, stables par fonction
+        title = f"{node['name']} — {node['value']} échantillons ({100 * node['value'] / total:.1f} %)"
+        parts.append(f'<g><title>{escape(title)}</title>'
+                     f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" '
+                     f'fill="hsl({hue}, 85%, 60%)" rx="2"/>')
+        chars = int((w - 6) / 7)
+        if chars >= 3:
+            text = node["name"] if len(node["name"]) <= chars else node["name"][:chars - 2] + ".."
+            parts.append(f'<text x="{x + 3:.1f}" y="{y + row - 5}">{escape(text)}</text>')
+        parts.append("</g>")
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+# ==========================
+# 🌐 Profilage des workers web, piloté depuis l'admin
+# ==========================
+def _write_json(path, data):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def start_profile(mode, seconds=30, route=None, requests=None, interval_ms=PROFILE_INTERVAL_MS):
+    """Arme un profil pour tous les workers ; mode 'duration' ou 'requests' (N requêtes sur `route`)"""
+    profile_id = uuid.uuid4().hex[:12]
+    seconds = min(max(int(seconds or PROFILE_MAX_SECONDS), 1), PROFILE_MAX_SECONDS)
+    meta = {
+        "id": profile_id,
+        "mode": mode,
+        "route": route if mode == "requests" else None,
+        "requests": int(requests or 1) if mode == "requests" else None,
+        "interval_ms": max(float(interval_ms), MIN_INTERVAL * 1000),
+        "created_at": time.time(),
+        "until": time.time() + seconds,
+    }
+    _write_json(os.path.join(PROFILE_DIR, f"{profile_id}.json"), meta)
+    _write_json(CONTROL_FILE, meta)
+    _control_cache["checked_at"] = 0
+    return profile_id
+
+
+def stop_profile():
+    try:
+        os.remove(CONTROL_FILE)
+    except FileNotFoundError:
+        pass
+    _control_cache["checked_at"] = 0
+
+
+_control_cache = {"checked_at": 0, "mtime": None, "control": None}
+
+
+def active_profile():
+    """Profil armé en cours (relu sur disque au plus toutes les CONTROL_CHECK_INTERVAL secondes)"""
+    now = time.monotonic()
+    if now - _control_cache["checked_at"] >= CONTROL_CHECK_INTERVAL:
+        _control_cache["checked_at"] = now
+        try:
+            mtime = os.stat(CONTROL_FILE).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime != _control_cache["mtime"]:
+            _control_cache["mtime"] = mtime
+            _control_cache["control"] = _read_json(CONTROL_FILE) if mtime else None
+    control = _control_cache["control"]
+    if control and control["until"] > time.time():
+        return control
+    return None
+
+
+_state = {"id": None, "sampler": None, "remaining": 0, "requests": 0}
+_state_lock = threading.Lock()
+_local = threading.local()
+
+
+def _save_worker_result(profile_id, sampler):
+    base = os.path.join(PROFILE_DIR, f"{profile_id}.{os.getpid()}")
+    write_collapsed(f"{base}.collapsed", sampler.stacks)
+    _write_json(f"{base}.stats", {
+        "pid": os.getpid(),
+        "samples": sampler.samples,
+        "dropped": sampler.dropped,
+        "elapsed": sampler.elapsed,
+        "overhead": sampler.overhead,
+        "requests": _state["requests"] if sampler.threads is not None and _state["id"] == profile_id else None,
+    })
+
+
+def _ensure_sampler(control):
+    """Démarre l'échantillonneur de ce worker pour le profil armé (une seule fois par profil)"""
+    if _state["id"] == control["id"]:
+        return _state["sampler"]
+    if _state["sampler"] is not None:
+        _state["sampler"].stop(wait=False)
+
+    profile_id = control["id"]
+    sampler = Sampler(control["interval_ms"], threads=set() if control["mode"] == "requests" else None)
+
+    def should_stop():
+        current = active_profile()
+        return current is None or current["id"] != profile_id
+
+    _state.update(id=profile_id, sampler=sampler, remaining=control["requests"] or 0, requests=0)
+    sampler.start(control["until"] - time.time(), should_stop,
+                  lambda s: _save_worker_result(profile_id, s))
+    return sampler
+
+
+def request_started(rule, path):
+    """À appeler en before_request : coût d'une comparaison quand aucun profil n'est armé"""
+    control = active_profile()
+    if control is None:
+        return
+    with _state_lock:
+        sampler = _ensure_sampler(control)
+        if control["mode"] != "requests" or not sampler.running:
+            return
+        if control["route"] not in (rule, path) or _state["remaining"] <= 0:
+            return
+        _state["remaining"] -= 1
+        sampler.threads.add(threading.get_ident())
+        _local.sampler = sampler
+
+
+def request_finished():
+    sampler = getattr(_local, "sampler", None)
+    if sampler is None:
+        return
+    _local.sampler = None
+    with _state_lock:
+        sampler.threads.discard(threading.get_ident())
+        if _state["sampler"] is sampler:
+            _state["requests"] += 1
+            if _state["remaining"] <= 0 and not sampler.threads:
+                sampler.stop(wait=False)
+
+
+def list_profiles():
+    profiles = []
+    if not os.path.isdir(PROFILE_DIR):
+        return profiles
+    active = active_profile()
+    for name in os.listdir(PROFILE_DIR):
+        profile_id, _, ext = name.partition(".")
+        if ext == "json" and PROFILE_ID.fullmatch(profile_id):
+            meta = _read_json(os.path.join(PROFILE_DIR, name))
+            if meta:
+                meta["active"] = bool(active and active["id"] == profile_id)
+                meta["workers"] = _worker_stats(profile_id)
+                profiles.append(meta)
+    return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+
+def _worker_stats(profile_id):
+    return [stats for stats in (_read_json(os.path.join(PROFILE_DIR, name))
+                                for name in os.listdir(PROFILE_DIR)
+                                if name.startswith(f"{profile_id}.") and name.endswith(".stats"))
+            if stats]
+
+
+def load_profile(profile_id):
+    """(métadonnées, piles fusionnées de tous les workers) ou None"""
+    if not PROFILE_ID.fullmatch(profile_id or ""):
+        return None
+    meta = _read_json(os.path.join(PROFILE_DIR, f"{profile_id}.json"))
+    if meta is None:
+        return None
+    stacks = Counter()
+    for name in os.listdir(PROFILE_DIR):
+        if name.startswith(f"{profile_id}.") and name.endswith(".collapsed"):
+            read_collapsed(os.path.join(PROFILE_DIR, name), stacks)
+    active = active_profile()
+    meta["active"] = bool(active and active["id"] == profile_id)
+    meta["workers"] = _worker_stats(profile_id)
+    return meta, stacks
+
+
+# ==========================
+# 🖥️ Ligne de commande : profiler un script d'envoi
+# ==========================
+if __name__ == "__main__":
+    import runpy
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Profile un script Python par échantillonnage")
+    parser.add_argument("-i", "--interval", type=float, default=PROFILE_INTERVAL_MS, help="intervalle (ms)")
+    parser.add_argument("-o", "--output", default="profil.collapsed", help="fichier de piles repliées")
+    parser.add_argument("--svg", help="écrit aussi un flamegraph SVG")
+    parser.add_argument("--top", type=int, default=20, help="nombre de fonctions affichées")
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    options = parser.parse_args()
+
+    sys.argv = [options.script] + options.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(options.script)))
+    sampler = Sampler(options.interval)
+    sampler.start()
+    try:
+        runpy.run_path(options.script, run_name="__main__")
+    except SystemExit:
+        pass
+    finally:
+        sampler.stop()
+        write_collapsed(options.output, sampler.stacks)
+        if options.svg:
+            with open(options.svg, "w", encoding="utf-8") as f:
+                f.write(flamegraph_svg(sampler.stacks))
+
+        print(f"\n🔬 {sampler.samples} échantillons en {sampler.elapsed:.1f}s "
+              f"(coût {100 * sampler.overhead:.1f} %), piles dans {options.output}")
+        print(f"{'propre':>8} {'cumulé':>8}  fonction")
+        for row in top_functions(sampler.stacks, options.top):
+            print(f"{row['self_pct']:7.1f}% {row['total_pct']:7.1f}%  {row['function']}")
@@ -0,0 +1,298 @@
+import os
+import re
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+# ==========================
+# 📚 Requêtes SQL de l'application (accès aux données centralisé)
+# ==========================
+# Chaque requête a un nom et n'est analysée/planifiée qu'une fois par
+# connexion (PREPARE côté serveur), puis exécutée avec EXECUTE. Les
+# connexions du pool (db.py) gardent leurs requêtes préparées.
+#
+# Derrière un PgBouncer en mode transaction (URL Neon "-pooler"), les PREPARE
+# ne survivent pas d'une transaction à l'autre : on repasse alors en requêtes
+# classiques (DB_PREPARED_STATEMENTS=0, valeur par défaut dans ce cas).
+#
+# Restent hors de ce module : le schéma et ses migrations (init_db,
+# search.SCHEMA_SQL, jobs.CREATE_TABLE_SQL...), les commandes de session
+# (SET LOCAL, verrou de init_db, LISTEN du worker), les vérifications
+# techniques de db.py (santé, retard de la réplique, statement_timeout du
+# rôle) et les benchmarks lancés via `python module.py`.
+
+load_dotenv()
+
+USE_PREPARED = os.getenv(
+    "DB_PREPARED_STATEMENTS",
+    "0" if "-pooler" in (os.getenv("DATABASE_URL") or "") else "1",
+) == "1"
+
+QUERIES = {
+    # --- Abonnés
+    "count_subscribers": "SELECT COUNT(*) AS count FROM subscribers",
+    "subscriber_emails": "SELECT email FROM subscribers ORDER BY subscribed_at DESC",
+    "insert_subscriber": """
+        INSERT INTO subscribers (email) VALUES ($1) ON CONFLICT DO NOTHING RETURNING id
+    """,
+    "delete_subscriber": "DELETE FROM subscribers WHERE email = $1",
+    "unsubscribe": """
+        WITH removed AS (DELETE FROM subscribers WHERE email = $1)
+        INSERT INTO suppressions (email, reason, provider) VALUES ($1, 'unsubscribe', 'site')
+        ON CONFLICT (email) DO NOTHING
+    """,
+
+    # --- Utilisateurs
+    "user_status": "SELECT status FROM users WHERE id = $1",
+    "user_profile": "SELECT email, company_name, status FROM users WHERE id = $1",
+    "user_id_by_email": "SELECT id FROM users WHERE email = $1",
+    "user_credentials": "SELECT id, password_hash, status FROM users WHERE email = $1",
+    "insert_user": """
+        INSERT INTO users (email, password_hash, company_name, phone) VALUES ($1, $2, $3, $4)
+    """,
+    "approve_user": "UPDATE users SET status = 'approved', approved_at = NOW() WHERE id = $1",
+    "reject_user": "UPDATE users SET status = 'rejected' WHERE id = $1",
+
+    # --- Soumissions
+    "user_submissions": """
+        SELECT id, title, description, image_url, link_url, category, status, created_at
+        FROM submissions
+        WHERE user_id = $1
+        ORDER BY created_at DESC
+    """,
+    "user_submission": """
+        SELECT id, title, description, image_url, link_url, category
+        FROM submissions WHERE id = $1 AND user_id = $2
+    """,
+    "insert_submission": """
+        INSERT INTO submissions (user_id, title, description, image_url, link_url, category)
+        VALUES ($1, $2, $3, $4, $5, $6)
+    """,
+    "update_submission": """
+        UPDATE submissions
+        SET title = $1, description = $2, image_url = $3, link_url = $4, category = $5
+        WHERE id = $6 AND user_id = $7
+    """,
+    "delete_user_submission": "DELETE FROM submissions WHERE id = $1 AND user_id = $2 RETURNING id",
+    "submission_image_url": """
+        SELECT image_url FROM submissions WHERE id = $1 AND status IN ('approved', 'published')
+    """,
+    "approve_submission": "UPDATE submissions SET status = 'approved' WHERE id = $1",
+    "reject_submission": "UPDATE submissions SET status = 'rejected' WHERE id = $1",
+    "approved_submissions": """
+        SELECT s.id, s.title, s.description, s.image_url, s.link_url, s.category,
+               s.created_at, u.company_name
+        FROM submissions s
+        JOIN users u ON s.user_id = u.id
+        WHERE s.status = 'approved'
+        ORDER BY s.category, s.created_at DESC
+    """,
+    "published_offers": """
+        SELECT s.id, s.title, s.description, s.image_url, s.link_url, s.category,
+               s.created_at, u.company_name
+        FROM submissions s
+        JOIN users u ON s.user_id = u.id
+        WHERE s.status IN ('approved', 'published')
+          AND ($1::text IS NULL OR s.category = $1::text)
+          AND ($2::timestamp IS NULL OR (s.created_at, s.id) < ($2::timestamp, $3::integer))
+        ORDER BY s.created_at DESC, s.id DESC
+        LIMIT $4
+    """,
+
+    # --- Recherche plein texte (search.py)
+    "search_submissions": """
+        SELECT * FROM (
+            SELECT s.id, s.title, s.description, s.category, s.image_url, s.link_url,
+                   s.status, s.created_at, u.company_name,
+                   ts_rank(s.search_vector, q) AS rank
+            FROM submissions s
+            JOIN users u ON s.user_id = u.id,
+                 websearch_to_tsquery('french', $1::text) q
+            WHERE s.search_vector @@ q
+              AND ($2::text[] IS NULL OR s.status = ANY($2::text[]))
+        ) r
+        WHERE $3::real IS NULL OR (r.rank, r.id) < ($3::real, $4::integer)
+        ORDER BY r.rank DESC, r.id DESC
+        LIMIT $5
+    """,
+
+    # --- Suppressions (bounces, plaintes, désinscriptions)
+    "suppressed_emails": "SELECT email FROM suppressions",
+
+    # --- File de tâches (jobs.py)
+    "enqueue_job": """
+        INSERT INTO jobs (job_type, payload, priority, max_attempts) VALUES ($1, $2, $3, $4) RETURNING id
+    """,
+    "notify_jobs": "SELECT pg_notify('jobs', '')",
+    "try_job_slot": "SELECT pg_try_advisory_lock($1::integer, $2::integer) AS ok",
+    "release_job_slot": "SELECT pg_advisory_unlock($1::integer, $2::integer)",
+    "claim_job": """
+        UPDATE jobs SET status = 'running', locked_at = NOW(), locked_by = $1,
+                        locked_pid = pg_backend_pid(), attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status = 'queued' AND run_at <= NOW() AND job_type = ANY($2::text[])
+            ORDER BY priority DESC, run_at, id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, job_type, payload, attempts, max_attempts
+    """,
+    "complete_job": """
+        UPDATE jobs SET status = 'done', result = $1, last_error = NULL, finished_at = NOW()
+        WHERE id = $2
+    """,
+    "retry_job": """
+        UPDATE jobs SET status = 'queued', last_error = $1, locked_at = NULL, locked_by = NULL,
+                        run_at = NOW() + $2::integer * INTERVAL '1 second'
+        WHERE id = $3
+    """,
+    "fail_job": """
+        UPDATE jobs SET status = 'failed', last_error = $1, finished_at = NOW()
+        WHERE id = $2
+    """,
+    # Tâche "running" dont la session (locked_pid) ne tient plus aucun verrou consultatif
+    "requeue_lost_jobs": """
+        UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                        finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE NOW() END,
+                        locked_at = NULL, locked_by = NULL, locked_pid = NULL,
+                        last_error = 'Worker perdu pendant l''exécution'
+        WHERE status = 'running'
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_locks l
+              WHERE l.locktype = 'advisory' AND l.granted AND l.pid = jobs.locked_pid
+          )
+    """,
+    "recent_jobs": """
+        SELECT id, job_type, priority, status, attempts, max_attempts, run_at,
+               locked_by, last_error, result, created_at, finished_at
+        FROM jobs ORDER BY id DESC LIMIT $1
+    """,
+
+    # --- Brouillons de newsletter (tâche render_newsletter)
+    "insert_newsletter_draft": """
+        INSERT INTO newsletter_drafts (html, submission_count) VALUES ($1, $2) RETURNING id
+    """,
+    "latest_newsletter_draft": "SELECT html, created_at FROM newsletter_drafts ORDER BY id DESC LIMIT 1",
+
+    # --- Admin
+    "admin_counts": """
+        SELECT (SELECT COUNT(*) FROM subscribers) AS subscriber_count,
+               (SELECT COUNT(*) FROM users WHERE status = 'pending') AS pending_users,
+               (SELECT COUNT(*) FROM submissions WHERE status = 'pending') AS pending_submissions
+    """,
+    "admin_users": """
+        SELECT u.id, u.email, u.company_name, u.phone, u.status, u.created_at,
+               (SELECT COUNT(*) FROM submissions s WHERE s.user_id = u.id) as submission_count
+        FROM users u
+        ORDER BY u.created_at DESC
+    """,
+    "admin_submissions": """
+        SELECT s.id, s.title, s.category, s.status, s.created_at,
+               u.email as user_email, u.company_name
+        FROM submissions s
+        JOIN users u ON s.user_id = u.id
+        ORDER BY s.created_at DESC
+    """,
+}
+
+# Écritures multi-lignes (execute_values) : un seul "VALUES %s", développé côté
+# client en lots de lignes. Elles ne passent pas par PREPARE : le texte change
+# avec le nombre de lignes du lot.
+BULK_QUERIES = {
+    "insert_subscribers": """
+        INSERT INTO subscribers (email) VALUES %s ON CONFLICT (email) DO NOTHING RETURNING email
+    """,
+    "insert_suppressions": """
+        INSERT INTO suppressions (email, reason, provider) VALUES %s ON CONFLICT (email) DO NOTHING
+    """,
+}
+
+_PARAM = re.compile(r"\$(\d+)")
+_PARAM_COUNT = {name: len(set(_PARAM.findall(sql))) for name, sql in QUERIES.items()}
+# Version psycopg2 (%(p1)s) des requêtes, pour le mode sans PREPARE
+_PLAIN = {name: _PARAM.sub(r"%(p\1)s", sql.replace("%", "%%")) for name, sql in QUERIES.items()}
+
+
+def _execute(cur, name, params):
+    if len(params) != _PARAM_COUNT[name]:
+        raise TypeError(f"{name} attend {_PARAM_COUNT[name]} paramètre(s), {len(params)} reçu(s)")
+
+    conn = cur.connection
+    prepared = getattr(conn, "prepared", None)
+    if not USE_PREPARED or prepared is None:
+        cur.execute(_PLAIN[name], {f"p{i + 1}": value for i, value in enumerate(params)})
+        return
+
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {QUERIES[name]}")
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def fetch_one(conn, name, *params):
+    cur = conn.cursor()
+    try:
+        _execute(cur, name, params)
+        return cur.fetchone()
+    finally:
+        cur.close()
+
+
+def fetch_all(conn, name, *params):
+    cur = conn.cursor()
+    try:
+        _execute(cur, name, params)
+        return cur.fetchall()
+    finally:
+        cur.close()
+
+
+def execute(conn, name, *params):
+    """Exécute une écriture et retourne le nombre de lignes touchées"""
+    cur = conn.cursor()
+    try:
+        _execute(cur, name, params)
+        return cur.rowcount
+    finally:
+        cur.close()
+
+
+def insert_many(conn, name, rows, fetch=False, page_size=500):
+    """Écriture multi-lignes nommée (BULK_QUERIES) en un minimum d'allers-retours"""
+    cur = conn.cursor()
+    try:
+        return execute_values(cur, BULK_QUERIES[name], rows, page_size=page_size, fetch=fetch)
+    finally:
+        cur.close()
+
+
+# ==========================
+# ⏱️ Benchmark : requête classique vs préparée sur la même connexion
+# ==========================
+if __name__ == "__main__":
+    import time
+    from db import get_db_connection
+
+    iterations = 500
+    conn = get_db_connection()
+    user = fetch_one(conn, "user_credentials", "nobody@example.org")
+    user_id = user["id"] if user else 0
+
+    for name, params in (("user_status", (user_id,)),
+                         ("approved_submissions", ()),
+                         ("admin_counts", ())):
+        timings = {}
+        for label, prepared_mode in (("classique", False), ("préparée", True)):
+            USE_PREPARED = prepared_mode
+            _execute(conn.cursor(), name, params)  # préparation hors mesure
+            start = time.perf_counter()
+            for _ in range(iterations):
+                fetch_all(conn, name, *params)
+            timings[label] = (time.perf_counter() - start) / iterations
+            conn.rollback()
+        print(f"{name:>22} : classique {timings['classique'] * 1e6:7.0f} µs, "
+              f"préparée {timings['préparée'] * 1e6:7.0f} µs")
+    conn.close()
@@ -0,0 +1,207 @@
+import os
+import time
+import random
+import sqlite3
+import tempfile
+import threading
+from functools import wraps
+from flask import request
+from dotenv import load_dotenv
+
+# ==========================
+# 🚦 Limitation de débit (anti-flood)
+# ==========================
+# Seau à jetons par IP et par email, partagé entre les workers gunicorn via
+# un petit fichier SQLite local. La vérification a lieu AVANT toute requête
+# PostgreSQL ou tout hachage de mot de passe.
+
+load_dotenv()
+
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "newsletter_ratelimit.sqlite3"))
+
+
+def _parse_limit(value, default):
+    """'5/60' -> (5 requêtes, 60 secondes)"""
+    try:
+        count, period = value.split("/")
+        return int(count), float(period)
+    except (AttributeError, ValueError):
+        return default
+
+
+# Limites par route, surchargées par ex. avec RATE_LIMIT_SUBSCRIBE="5/60"
+RATE_LIMITS = {
+    "subscribe": _parse_limit(os.getenv("RATE_LIMIT_SUBSCRIBE"), (5, 60)),
+    "login": _parse_limit(os.getenv("RATE_LIMIT_LOGIN"), (10, 300)),
+    "register": _parse_limit(os.getenv("RATE_LIMIT_REGISTER"), (3, 3600)),
+}
+
+
+class TokenBucketStore:
+    def __init__(self, path=RATE_LIMIT_DB):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, capacity, period):
+        """Consomme un jeton ; retourne (autorisé, secondes avant le prochain jeton)"""
+        now = time.time()
+        rate = capacity / period
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                tokens = float(capacity)
+            else:
+                tokens = min(capacity, row[0] + (now - row[1]) * rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+
+            # Ménage occasionnel des seaux pleins depuis longtemps
+            if random.random() < 0.01:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - 86400,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+_store = TokenBucketStore()
+
+
+def client_ip():
+    # X-Forwarded-For est déjà résolu par ProxyFix (app.py) : seule l'adresse
+    # ajoutée par notre proxy de confiance compte, les entrées envoyées par le
+    # client lui-même sont ignorées
+    return request.remote_addr
+
+
+def rate_limited(name):
+    """Décorateur : limite les POST d'une route par IP et par email"""
+    capacity, period = RATE_LIMITS[name]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method == "POST":
+                keys = [f"{name}:ip:{client_ip()}"]
+                email = request.form.get("email", "").strip().lower()
+                if email:
+                    keys.append(f"{name}:email:{email}")
+                try:
+                    for key in keys:
+                        allowed, retry_after = _store.hit(key, capacity, period)
+                        if not allowed:
+                            return ("Trop de tentatives, veuillez réessayer plus tard.", 429,
+                                    {"Retry-After": str(int(retry_after) + 1)})
+                except sqlite3.Error as e:
+                    # Fichier verrouillé = forte contention, typiquement pendant un flood :
+                    # laisser passer désactiverait le limiteur au pire moment
+                    print(f"Erreur rate limit: {e}")
+                    return ("Service momentanément surchargé, veuillez réessayer.", 503,
+                            {"Retry-After": "5"})
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+# ==========================
+# 🌊 Test de charge : flood de /subscribe et /login par plusieurs processus
+# ==========================
+# Chaque process est un "worker gunicorn" qui envoie ses requêtes à l'app via
+# le client de test Flask, depuis une même IP. Les accès à PostgreSQL
+# (add_subscriber, get_read_connection) sont remplacés par des compteurs
+# partagés : on vérifie qu'ils restent sous capacité + durée × débit.
+if __name__ == "__main__":
+    import multiprocessing
+    from types import SimpleNamespace
+
+    path = os.path.join(tempfile.gettempdir(), "newsletter_ratelimit_bench.sqlite3")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.environ["RATE_LIMIT_DB"] = path
+
+    import db
+    db_calls = {"subscribe": multiprocessing.Value("i", 0), "login": multiprocessing.Value("i", 0)}
+
+    def no_database(*args, **kwargs):
+        raise db.DatabaseUnavailable("base simulée")
+
+    # Aucune vraie connexion, même pour init_db à l'import de l'app
+    db.get_db_connection = db.get_read_connection = no_database
+    import app as newsletter_app
+
+    def count(route):
+        with db_calls[route].get_lock():
+            db_calls[route].value += 1
+
+    def add_subscriber(email):
+        count("subscribe")
+        return True
+
+    def get_read_connection(*args, **kwargs):
+        count("login")
+        return no_database()
+
+    newsletter_app.add_subscriber = add_subscriber
+    newsletter_app.get_read_connection = get_read_connection
+    newsletter_app.validate_email = lambda email: SimpleNamespace(email=email)  # pas de DNS
+    newsletter_app.FORM_MIN_SECONDS = 0
+    newsletter_app._cache.set("subscriber_count", 0)
+    newsletter_app.app.config["WTF_CSRF_ENABLED"] = False
+    form_token = newsletter_app._form_signer.sign("bench").decode()
+
+    def flood(worker):
+        client = newsletter_app.app.test_client()
+        client.environ_base["REMOTE_ADDR"] = "203.0.113.7"
+        statuses = {}
+        for i in range(requests_per_worker):
+            email = f"flood-{worker}-{i}@example.org"  # emails tous différents : seule l'IP limite
+            if i % 2:
+                response = client.post("/login", data={"email": email, "password": "x"})
+            else:
+                response = client.post("/subscribe", data={"email": email, "form_token": form_token})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return statuses
+
+    workers, requests_per_worker = 4, 1000
+    start = time.perf_counter()
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        results = pool.map(flood, range(workers))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for result in results:
+        for status, n in result.items():
+            statuses[status] = statuses.get(status, 0) + n
+    total = workers * requests_per_worker
+    print(f"{total} requêtes en {elapsed:.2f}s ({total / elapsed:.0f} req/s) sur {workers} process, "
+          f"statuts {dict(sorted(statuses.items()))}")
+    for route in ("subscribe", "login"):
+        capacity, period = RATE_LIMITS[route]
+        bound = capacity + elapsed * capacity / period
+        calls = db_calls[route].value
+        print(f"/{route} : {calls} accès à la base (borne {bound:.1f}, limite {capacity}/{period:.0f}s)")
+        assert calls <= bound, f"/{route} : le limiteur a laissé passer {calls} requêtes"
@@ -0,0 +1,157 @@
+import queries
+
+# ==========================
+# 🔎 Recherche plein texte dans les soumissions
+# ==========================
+# Colonne `search_vector` (tsvector français) indexée en GIN. PostgreSQL
+# n'autorise pas une colonne GENERATED qui lit une autre table : le vecteur
+# (titre, nom du commerçant, catégorie, description) est donc tenu à jour
+# par des triggers sur `submissions` et sur `users.company_name`.
+
+# Exécuté à chaque démarrage (sous le verrou consultatif de init_db) : on ne
+# touche au schéma que s'il manque quelque chose. ALTER TABLE et CREATE/DROP
+# TRIGGER prennent un verrou ACCESS EXCLUSIVE, même quand il n'y a rien à faire.
+SCHEMA_SQL = [
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_attribute
+                       WHERE attrelid = 'submissions'::regclass AND attname = 'search_vector'
+                         AND NOT attisdropped) THEN
+            ALTER TABLE submissions ADD COLUMN search_vector tsvector;
+        END IF;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION submission_search_vector(sub submissions) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('french', coalesce(sub.title, '')), 'A')
+            || setweight(to_tsvector('french', coalesce(
+                   (SELECT company_name FROM users WHERE id = sub.user_id), '')), 'B')
+            || setweight(to_tsvector('french', coalesce(sub.category, '')), 'C')
+            || setweight(to_tsvector('french', coalesce(sub.description, '')), 'D')
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION submissions_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := submission_search_vector(NEW);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                       WHERE tgrelid = 'submissions'::regclass AND tgname = 'submissions_search_update') THEN
+            CREATE TRIGGER submissions_search_update
+                BEFORE INSERT OR UPDATE OF title, description, category, user_id ON submissions
+                FOR EACH ROW EXECUTE FUNCTION submissions_search_trigger();
+        END IF;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION users_company_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        UPDATE submissions s SET search_vector = submission_search_vector(s) WHERE s.user_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                       WHERE tgrelid = 'users'::regclass AND tgname = 'users_company_search_update') THEN
+            CREATE TRIGGER users_company_search_update
+                AFTER UPDATE OF company_name ON users
+                FOR EACH ROW WHEN (OLD.company_name IS DISTINCT FROM NEW.company_name)
+                EXECUTE FUNCTION users_company_search_trigger();
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS submissions_search_idx ON submissions USING GIN (search_vector)",
+    # Rattrapage des lignes existantes (ne fait rien une fois remplies)
+    "UPDATE submissions s SET search_vector = submission_search_vector(s) WHERE search_vector IS NULL",
+]
+
+PUBLISHED_STATUSES = ("approved", "published")
+
+def init_search(cur):
+    for sql in SCHEMA_SQL:
+        cur.execute(sql)
+
+
+def parse_cursor(value):
+    """'0.0607927:42' -> (0.0607927, 42) ; None si absent ou invalide"""
+    try:
+        rank, submission_id = value.split(":")
+        return float(rank), int(submission_id)
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def search_submissions(conn, query, published_only=True, after=None, limit=20):
+    """Résultats classés par pertinence + curseur de la page suivante (keyset)"""
+    after_rank, after_id = parse_cursor(after)
+    rows = queries.fetch_all(conn, "search_submissions", query,
+                             list(PUBLISHED_STATUSES) if published_only else None,
+                             after_rank, after_id, limit)
+    next_cursor = None
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        next_cursor = f"{last['rank']!r}:{last['id']}"
+    return rows, next_cursor
+
+
+# ==========================
+# ⏱️ Benchmark : latence de recherche sur 100 000+ soumissions
+# ==========================
+if __name__ == "__main__":
+    import os
+    import time
+    import random
+    import psycopg2
+    from psycopg2.extras import RealDictCursor, execute_values
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"), cursor_factory=RealDictCursor)
+    cur = conn.cursor()
+    init_search(cur)
+
+    words = ["moto", "soldes", "pizza", "boulangerie", "coiffure", "vélo", "fromage",
+             "bijoux", "jardin", "promotion", "marché", "artisan", "garage", "fleurs"]
+    categories = ["general", "restaurant", "mode", "services", "loisirs"]
+    total = 100_000
+
+    cur.execute("""
+        INSERT INTO users (email, password_hash, company_name, status)
+        VALUES ('bench-search@example.org', '-', 'Garage Bench Moto', 'approved')
+        ON CONFLICT (email) DO UPDATE SET company_name = EXCLUDED.company_name
+        RETURNING id
+    """)
+    user_id = cur.fetchone()["id"]
+
+    start = time.perf_counter()
+    rows = [(user_id, " ".join(random.choices(words, k=4)), " ".join(random.choices(words, k=30)),
+             random.choice(categories), random.choice(("approved", "published", "pending")))
+            for _ in range(total)]
+    execute_values(cur, """
+        INSERT INTO submissions (user_id, title, description, category, status) VALUES %s
+    """, rows, page_size=1000)
+    conn.commit()
+    print(f"{total} soumissions insérées en {time.perf_counter() - start:.1f}s")
+
+    for query in ("moto", "soldes fromage", "Garage Bench", "introuvable"):
+        timings = []
+        for _ in range(20):
+            start = time.perf_counter()
+            results, cursor = search_submissions(conn, query)
+            if cursor:
+                search_submissions(conn, query, after=cursor)
+            timings.append((time.perf_counter() - start) / (2 if cursor else 1))
+        timings.sort()
+        print(f"{query!r:>18} : médiane {timings[10] * 1000:6.1f} ms, p95 {timings[18] * 1000:6.1f} ms")
+
+    cur.execute("DELETE FROM submissions WHERE user_id = %s", (user_id,))
+    cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+    conn.commit()
+    conn.close()
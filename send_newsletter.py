@@ -1,12 +1,23 @@
+import os
 import json
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from newsletter_template import MimeBuilder
+from smtp_pool import SmtpPool
+from email_optimizer import optimize_edition
+from db import get_db_connection
+from suppressions import load_suppression_set
 
 # Charger les emails depuis subscribers.json
 with open("subscribers.json", "r") as file:
     subscribers = json.load(file)
 
+# Exclure les adresses en erreur, les plaintes et les désinscriptions (table suppressions)
+conn = get_db_connection()
+suppressed = load_suppression_set(conn)
+conn.close()
+skipped = sum(1 for email in subscribers if email.strip().lower() in suppressed)
+subscribers = [email for email in subscribers if email.strip().lower() not in suppressed]
+print(f"🚫 {skipped} adresse(s) ignorée(s) (bounce, plainte ou désinscription)")
+
 # Charger le contenu HTML de la newsletter
 with open("email_newsletter.html", "r", encoding="utf-8") as f:
     newsletter_html = f.read()
@@ -16,21 +27,22 @@ EMAIL = "lesbonnesaffairesaurillac@gmail.com"
 PASSWORD = "lpef rbys duiq orvz"
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 587
+SMTP_CONNECTIONS = int(os.getenv("SMTP_CONNECTIONS", "4"))  # sessions en parallèle
+SMTP_MAX_PER_SESSION = int(os.getenv("SMTP_MAX_PER_SESSION", "90"))  # avant recyclage
+
+# Optimisation unique de l'édition (minification, version texte, budget de taille)
+edition = optimize_edition(newsletter_html)
+print(f"🗜️ {edition['report']}")
+
+# Édition compilée une seule fois (en-têtes et HTML pré-encodés)
+builder = MimeBuilder(edition["html"], EMAIL, "📰 Votre Newsletter Hebdo", text=edition["text"])
+
+# Envoi de la newsletter à chaque abonné (reconnexion automatique en cas de coupure)
+pool = SmtpPool(SMTP_SERVER, SMTP_PORT, EMAIL, PASSWORD,
+                connections=SMTP_CONNECTIONS, max_per_session=SMTP_MAX_PER_SESSION)
+stats = pool.send_all(EMAIL, subscribers, builder.build)
 
-# Envoi de la newsletter à chaque abonné
-with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-    server.starttls()
-    server.login(EMAIL, PASSWORD)
-    
-    for recipient in subscribers:
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = "📰 Votre Newsletter Hebdo"
-        msg["From"] = EMAIL
-        msg["To"] = recipient
-
-        # Ajouter le contenu HTML (images hébergées en ligne)
-        html_part = MIMEText(newsletter_html, "html")
-        msg.attach(html_part)
-
-        server.sendmail(EMAIL, recipient, msg.as_string())
-        print(f"✅ Newsletter envoyée à {recipient}")
+print(f"\n🎉 {stats['sent']} envoyés, {stats['failed']} échecs, {stats['retries']} nouvelles tentatives, "
+      f"{stats['connections']} connexions en {stats['elapsed']:.1f}s ({stats['rate']:.1f} msg/s)")
+if stats["aborted"]:
+    raise SystemExit(f"❌ Envoi abandonné, serveur SMTP injoignable: {pool.abort_error}")
@@ -1,9 +1,13 @@
 import os
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from db import get_db_connection
+import queries
+from newsletter_template import CompiledEdition, recipient_values
+from suppressions import load_suppression_set
+from image_proxy import thumbnail_url
+from email_optimizer import optimize_edition
 
 load_dotenv()
 
@@ -11,31 +15,14 @@ load_dotenv()
 BREVO_API_KEY = os.getenv("BREVO_API_KEY")  # ou mettez directement "xkeysib-..."
 configuration = sib_api_v3_sdk.Configuration()
 configuration.api_key['api-key'] = BREVO_API_KEY
+# Surchargée par bench_envoi.py pour envoyer vers un faux fournisseur local
+if os.getenv("BREVO_API_BASE"):
+    configuration.host = os.getenv("BREVO_API_BASE")
 
-# Connexion PostgreSQL
-DATABASE_URL = os.getenv("DATABASE_URL")
-conn = psycopg2.connect(DATABASE_URL, sslmode="require", cursor_factory=RealDictCursor)
-cur = conn.cursor()
-
-# Récupérer les abonnés
-cur.execute("SELECT email FROM subscribers")
-subscribers = [row["email"] for row in cur.fetchall()]
-
-# Récupérer les soumissions approuvées
-cur.execute("""
-    SELECT s.*, u.company_name 
-    FROM submissions s
-    JOIN users u ON s.user_id = u.id
-    WHERE s.status = 'approved'
-    ORDER BY s.category, s.created_at DESC
-""")
-submissions = cur.fetchall()
-
-cur.close()
-conn.close()
-
-# Générer le HTML
-newsletter_html = """
+
+def build_newsletter_html(submissions):
+    """HTML de l'édition à partir des soumissions approuvées"""
+    newsletter_html = """
 <!DOCTYPE html>
 <html lang="fr">
 <head>
@@ -46,47 +33,96 @@ newsletter_html = """
     <h1 style="text-align: center; color: #003366;">LES PLANS MALIN</h1>
 """
 
-for sub in submissions:
-    newsletter_html += f'''
+    for sub in submissions:
+        newsletter_html += f'''
     <div style="border: 1px solid #ddd; padding: 20px; border-radius: 8px; margin-bottom: 20px; display: flex; gap: 20px;">
         <div style="flex: 1;">
             <span style="color: #007bff; font-weight: bold; font-size: 12px;">{sub["category"].upper()}</span>
             <h4 style="margin: 5px 0 10px;">{sub["title"]}</h4>
             <p style="margin: 0 0 10px;">{sub["description"]}</p>
 '''
-    if sub.get("link_url"):
-        newsletter_html += f'            <a href="{sub["link_url"]}" style="background-color: #007bff; color: white; padding: 8px 16px; text-decoration: none; border-radius: 4px;">Lire la suite</a>\n'
+        if sub.get("link_url"):
+            newsletter_html += f'            <a href="{sub["link_url"]}" style="background-color: #007bff; color: white; padding: 8px 16px; text-decoration: none; border-radius: 4px;">Lire la suite</a>\n'
     
-    newsletter_html += '        </div>\n'
+        newsletter_html += '        </div>\n'
     
-    if sub.get("image_url"):
-        newsletter_html += f'        <img src="{sub["image_url"]}" style="width: 180px; height: auto; border-radius: 8px;">\n'
+        if sub.get("image_url"):
+            # Miniature servie par notre proxy plutôt que l'original du commerçant
+            newsletter_html += f'        <img src="{thumbnail_url(sub, 180)}" srcset="{thumbnail_url(sub, 360)} 2x" width="180" style="width: 180px; height: auto; border-radius: 8px;">\n'
     
-    newsletter_html += '    </div>\n'
+        newsletter_html += '    </div>\n'
 
-newsletter_html += """
+    newsletter_html += """
     <p style="text-align: center; font-size: 13px; color: #777; margin-top: 30px;">
-        Merci de faire vivre notre ville ♥
+        Merci de faire vivre notre ville ♥<br>
+        <a href="{{ unsubscribe_url }}" style="color: #777;">Se désinscrire</a>
     </p>
 </body>
 </html>
 """
+    return newsletter_html
 
-# Envoi via Brevo
-api_instance = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
 
-for recipient in subscribers:
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=[{"email": recipient}],
-        sender={"name": "Newsletter Locale", "email": "newsletter@la-newsletter-aurillac.fr"},
-        subject="📰 Votre Newsletter Hebdo - Les Plans Malin",
-        html_content=newsletter_html
-    )
-    
-    try:
-        api_response = api_instance.send_transac_email(send_smtp_email)
+def print_result(recipient, error):
+    if error is None:
         print(f"✅ Newsletter envoyée à {recipient}")
-    except ApiException as e:
-        print(f"❌ Erreur pour {recipient}: {e}")
+    else:
+        print(f"❌ Erreur pour {recipient}: {error}")
+
+
+def send_edition(subscribers, newsletter_html, on_result=print_result):
+    """Envoie l'édition à chaque abonné via l'API Brevo ; retourne {"sent", "failed"}"""
+    # Optimisation unique de l'édition (minification, version texte, budget de taille)
+    optimized = optimize_edition(newsletter_html)
+    print(f"🗜️ {optimized['report']}")
+
+    # Édition découpée une seule fois autour des emplacements personnalisés
+    edition = CompiledEdition(optimized["html"])
+    text_edition = CompiledEdition(optimized["text"])
+
+    # Envoi via Brevo
+    api_instance = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
+
+    stats = {"sent": 0, "failed": 0}
+    for recipient in subscribers:
+        values = recipient_values(recipient)
+        send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
+            to=[{"email": recipient}],
+            sender={"name": "Newsletter Locale", "email": "newsletter@la-newsletter-aurillac.fr"},
+            subject="📰 Votre Newsletter Hebdo - Les Plans Malin",
+            html_content=edition.render(values),
+            text_content=text_edition.render(values),
+            headers={"List-Unsubscribe": f"<{values['unsubscribe_url']}>",
+                     "List-Unsubscribe-Post": "List-Unsubscribe=One-Click"}
+        )
+
+        try:
+            api_instance.send_transac_email(send_smtp_email)
+            stats["sent"] += 1
+            on_result(recipient, None)
+        except ApiException as e:
+            stats["failed"] += 1
+            on_result(recipient, e)
+    return stats
+
+
+if __name__ == "__main__":
+    # Connexion PostgreSQL
+    conn = get_db_connection()
+
+    # Récupérer les abonnés
+    subscribers = [row["email"] for row in queries.fetch_all(conn, "subscriber_emails")]
+
+    # Exclure les adresses en erreur, les plaintes et les désinscriptions
+    suppressed = load_suppression_set(conn)
+    skipped = sum(1 for email in subscribers if email in suppressed)
+    subscribers = [email for email in subscribers if email not in suppressed]
+    print(f"🚫 {skipped} adresse(s) ignorée(s) (bounce, plainte ou désinscription)")
+
+    # Récupérer les soumissions approuvées
+    submissions = queries.fetch_all(conn, "approved_submissions")
+
+    conn.close()
 
-print(f"\n🎉 Newsletter envoyée à {len(subscribers)} abonnés !")
\ No newline at end of file
+    stats = send_edition(subscribers, build_newsletter_html(submissions))
+    print(f"\n🎉 Newsletter envoyée à {stats['sent']} abonnés !")
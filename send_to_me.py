@@ -1,6 +1,6 @@
 import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from newsletter_template import MimeBuilder
+from email_optimizer import optimize_edition
 
 # 🔑 Mets ton email et ton mot de passe/clé d'application Gmail
 MY_EMAIL = "lesbonnesaffairesaurillac@gmail.com"
@@ -11,18 +11,14 @@ TO_EMAIL = "bessonpierre15@gmail.com"   # tu t'envoies à toi-même
 with open("email_newsletter.html", "r", encoding="utf-8") as f:
     newsletter_html = f.read()
 
-# Préparer le mail
-msg = MIMEMultipart("alternative")
-msg["Subject"] = "TEST - Newsletter"
-msg["From"] = MY_EMAIL
-msg["To"] = TO_EMAIL
-
-# Ajouter la version HTML
-msg.attach(MIMEText(newsletter_html, "html"))
+# Préparer le mail (même construction que l'envoi réel)
+edition = optimize_edition(newsletter_html)
+print(f"🗜️ {edition['report']}")
+builder = MimeBuilder(edition["html"], MY_EMAIL, "TEST - Newsletter", text=edition["text"])
 
 # Envoi via Gmail SMTP
 with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
     server.login(MY_EMAIL, MY_PASSWORD)
-    server.sendmail(MY_EMAIL, TO_EMAIL, msg.as_string())
+    server.sendmail(MY_EMAIL, TO_EMAIL, builder.build(TO_EMAIL))
 
 print("✅ Newsletter envoyée en test à", TO_EMAIL)
@@ -0,0 +1,181 @@
+import smtplib
+import threading
+import time
+import queue
+
+# ==========================
+# 📮 Envoi SMTP avec plusieurs connexions en parallèle
+# ==========================
+# Chaque connexion vit dans son propre thread, est authentifiée une seule
+# fois puis recyclée après `max_per_session` messages (limite imposée par
+# la plupart des fournisseurs). Une coupure (421, déconnexion, timeout) ne
+# fait plus échouer tout l'envoi : on se reconnecte et on retente.
+#
+# Un échec de connexion n'est pas imputé au destinataire en cours : il reste
+# en file. Après `max_connect_failures` échecs de connexion consécutifs (tous
+# threads confondus), ou une erreur définitive (authentification refusée),
+# l'envoi est abandonné et les destinataires restants sont signalés en échec,
+# au lieu que chacun attende toute la série de nouvelles tentatives.
+
+TRANSIENT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+def is_transient(error):
+    """Vrai si l'erreur mérite une nouvelle tentative (codes 4xx, coupures)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class SmtpPool:
+    def __init__(self, host, port, user=None, password=None, connections=4,
+                 max_per_session=100, max_retries=3, backoff=1.0,
+                 starttls=True, use_ssl=False, timeout=30, max_connect_failures=5):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.connections = connections
+        self.max_per_session = max_per_session
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.max_connect_failures = max_connect_failures
+
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        self._connect_failures = 0
+        self.abort_error = None
+        self.stats = {}
+
+    def _connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                server.starttls()
+        if self.user:
+            server.login(self.user, self.password)
+        self._count("connections")
+        return server
+
+    @staticmethod
+    def _close(server):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def _connect_failed(self, error):
+        """Compte un échec de connexion ; False si l'envoi doit être abandonné"""
+        self._count("connect_failures")
+        with self._lock:
+            self._connect_failures += 1
+            failures = self._connect_failures
+        if not is_transient(error) or failures >= self.max_connect_failures:
+            if not self._abort.is_set():
+                print(f"❌ Serveur SMTP injoignable ({failures} échec(s) de connexion), envoi abandonné: {error}")
+            self.abort_error = error
+            self._abort.set()
+            return False
+        time.sleep(self.backoff * (2 ** (failures - 1)))
+        return True
+
+    def _worker(self, jobs, sender, build, on_result):
+        server = None
+        sent_on_session = 0
+        while not self._abort.is_set():
+            try:
+                recipient, attempt = jobs.get_nowait()
+            except queue.Empty:
+                break
+
+            if server is None or sent_on_session >= self.max_per_session:
+                if server is not None:
+                    self._count("recycled")
+                self._close(server)
+                server = None
+                try:
+                    server = self._connect()
+                except Exception as e:
+                    # Le destinataire n'y est pour rien : il retourne en file sans tentative comptée
+                    jobs.put((recipient, attempt))
+                    if not self._connect_failed(e):
+                        break
+                    continue
+                with self._lock:
+                    self._connect_failures = 0
+                sent_on_session = 0
+
+            try:
+                server.sendmail(sender, recipient, build(recipient))
+                sent_on_session += 1
+                self._count("sent")
+                on_result(recipient, None)
+            except Exception as e:
+                if is_transient(e) and attempt < self.max_retries:
+                    self._count("retries")
+                    # Session potentiellement morte : on repart sur une neuve
+                    self._close(server)
+                    server = None
+                    time.sleep(self.backoff * (2 ** attempt))
+                    jobs.put((recipient, attempt + 1))
+                else:
+                    self._count("failed")
+                    on_result(recipient, e)
+
+        self._close(server)
+
+    def send_all(self, sender, recipients, build, on_result=None):
+        """Envoie `build(recipient)` à chaque destinataire et retourne les stats"""
+        if on_result is None:
+            def on_result(recipient, error):
+                if error is None:
+                    print(f"✅ Newsletter envoyée à {recipient}")
+                else:
+                    print(f"❌ Erreur pour {recipient}: {error}")
+
+        jobs = queue.Queue()
+        for recipient in recipients:
+            jobs.put((recipient, 0))
+
+        self.stats = {"sent": 0, "failed": 0, "retries": 0, "connections": 0, "recycled": 0,
+                      "connect_failures": 0}
+        self._abort.clear()
+        self._connect_failures = 0
+        self.abort_error = None
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._worker, args=(jobs, sender, build, on_result))
+            for _ in range(min(self.connections, max(jobs.qsize(), 1)))
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Envoi abandonné : les destinataires restants sont signalés, pas oubliés
+        while self._abort.is_set():
+            try:
+                recipient, _ = jobs.get_nowait()
+            except queue.Empty:
+                break
+            self._count("failed")
+            on_result(recipient, self.abort_error)
+        self.stats["aborted"] = self._abort.is_set()
+
+        elapsed = time.perf_counter() - start
+        self.stats["elapsed"] = elapsed
+        self.stats["rate"] = self.stats["sent"] / elapsed if elapsed else 0.0
+        return self.stats
@@ -0,0 +1,78 @@
+import time
+import threading
+
+# ==========================
+# ♻️ Cache "stale-while-revalidate"
+# ==========================
+# Une valeur fraîche (moins de `ttl` secondes) est servie telle quelle. Une
+# valeur périmée est servie IMMÉDIATEMENT pendant qu'un thread la recharge :
+# la requête ne paie jamais le réveil de la base (Neon en veille) ni une panne.
+# Un seul rechargement à la fois par clé ; en cas d'échec l'ancienne valeur
+# reste en place et le rechargement est retenté après RETRY_DELAY secondes.
+
+RETRY_DELAY = 5
+
+
+class StaleCache:
+    def __init__(self):
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, ttl, default=None):
+        """Valeur de `key`, rechargée via `loader()` si besoin"""
+        return self.lookup(key, loader, ttl, default)[0]
+
+    def lookup(self, key, loader, ttl, default=None):
+        """Comme get, mais retourne (valeur, chargée) : chargée=False si c'est `default`
+        faute d'avoir jamais pu charger la clé (à ne pas mettre en cache côté HTTP)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                if time.time() - loaded_at < ttl or key in self._refreshing:
+                    return value, True
+                self._refreshing.add(key)
+        if entry is not None:
+            threading.Thread(target=self._refresh, args=(key, loader, ttl), daemon=True).start()
+            return entry[0], True
+
+        # Première lecture : rien à servir, on charge en direct
+        try:
+            value = loader()
+        except Exception as e:
+            print(f"Erreur chargement cache {key}: {e}")
+            return default, False
+        self.set(key, value)
+        return value, True
+
+    def _refresh(self, key, loader, ttl):
+        try:
+            self.set(key, loader())
+        except Exception as e:
+            print(f"Erreur rafraîchissement cache {key} (valeur périmée conservée): {e}")
+            with self._lock:
+                value, _ = self._entries[key]
+                # Considérée fraîche encore RETRY_DELAY secondes : pas de tentative à chaque requête
+                self._entries[key] = (value, time.time() - ttl + RETRY_DELAY)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+
+    def update(self, key, fn):
+        """Modifie la valeur en place (ex : compteur +1) sans changer son âge"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (fn(entry[0]), entry[1])
+
+    def invalidate(self, key):
+        """Marque la valeur comme périmée : elle reste servie jusqu'au rechargement"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], 0)
@@ -0,0 +1,129 @@
+import threading
+import queries
+
+# ==========================
+# 📥 Inscriptions regroupées (pics de trafic)
+# ==========================
+# Pendant un pic (ex : après un post sur les réseaux), les inscriptions
+# simultanées d'un même worker sont regroupées en un seul INSERT multi-lignes.
+# La première requête attend `window` secondes, ramasse les emails arrivés
+# entre-temps et fait l'unique aller-retour pour tout le lot.
+# Utile seulement avec des workers multi-threads (gunicorn --threads).
+
+class _Pending:
+    def __init__(self, email):
+        self.email = email
+        self.done = threading.Event()
+        self.inserted = False
+        self.error = None
+
+
+class SubscribeBatcher:
+    def __init__(self, connect, window=0.005, max_batch=500):
+        self.connect = connect
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._batch = []
+        self._full = threading.Event()
+
+    def insert(self, email):
+        """Retourne True si l'email vient d'être ajouté, False s'il existait déjà"""
+        pending = _Pending(email)
+        with self._lock:
+            self._batch.append(pending)
+            leader = len(self._batch) == 1
+            if len(self._batch) >= self.max_batch:
+                self._full.set()
+
+        if leader:
+            self._full.wait(self.window)
+            with self._lock:
+                batch, self._batch = self._batch, []
+                self._full.clear()
+            self._flush(batch)
+
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.inserted
+
+    def _flush(self, batch):
+        try:
+            emails = list(dict.fromkeys(p.email for p in batch))
+            conn = self.connect()
+            try:
+                rows = queries.insert_many(conn, "insert_subscribers", [(e,) for e in emails], fetch=True)
+                conn.commit()
+            finally:
+                conn.close()
+            inserted = {row["email"] for row in rows}
+            claimed = set()
+            for p in batch:
+                # Un même email soumis deux fois dans le lot : un seul "succès"
+                p.inserted = p.email in inserted and p.email not in claimed
+                claimed.add(p.email)
+        except Exception as e:
+            for p in batch:
+                p.error = e
+        finally:
+            for p in batch:
+                p.done.set()
+
+
+# ==========================
+# ⏱️ Benchmark : inscriptions/seconde avant / après
+# ==========================
+if __name__ == "__main__":
+    import os
+    import time
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    DATABASE_URL = os.getenv("DATABASE_URL")
+
+    def connect():
+        return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+
+    def legacy(email):
+        # Ancien chemin : existence, insertion, puis recomptage (3 connexions)
+        for sql in ("SELECT 1 FROM subscribers WHERE email = %s LIMIT 1",
+                    "INSERT INTO subscribers (email) VALUES (%s) ON CONFLICT DO NOTHING",
+                    "SELECT COUNT(*) as count FROM subscribers"):
+            conn = connect()
+            cur = conn.cursor()
+            cur.execute(sql, (email,) if "%s" in sql else None)
+            conn.commit()
+            cur.close()
+            conn.close()
+
+    def single(email):
+        conn = connect()
+        cur = conn.cursor()
+        cur.execute("INSERT INTO subscribers (email) VALUES (%s) ON CONFLICT DO NOTHING RETURNING id", (email,))
+        cur.fetchone()
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    batcher = SubscribeBatcher(connect)
+    total, threads = 2000, 32
+    tag = uuid.uuid4().hex[:8]
+
+    for name, fn in (("3 allers-retours", legacy), ("INSERT ... RETURNING", single), ("regroupé", batcher.insert)):
+        emails = [f"bench-{tag}-{name[:3]}-{i}@example.org" for i in range(total)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(fn, emails))
+        elapsed = time.perf_counter() - start
+        print(f"{name:>22} : {total / elapsed:7.0f} inscriptions/s")
+
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM subscribers WHERE email LIKE %s", (f"bench-{tag}-%",))
+    conn.commit()
+    conn.close()
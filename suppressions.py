@@ -0,0 +1,160 @@
+import os
+import hmac
+import time
+import hashlib
+import atexit
+import threading
+from dotenv import load_dotenv
+import queries
+
+# ==========================
+# 🚫 Suppressions (bounces, plaintes, désinscriptions)
+# ==========================
+# Les webhooks Brevo / Mailgun ne font qu'ajouter l'événement à une file en
+# mémoire ; un thread l'écrit par lots dans la table `suppressions`. Les
+# scripts d'envoi chargent la table une fois dans un set et sautent ces
+# adresses (test O(1) par destinataire).
+
+load_dotenv()
+
+BREVO_WEBHOOK_TOKEN = os.getenv("BREVO_WEBHOOK_TOKEN")
+MAILGUN_WEBHOOK_SIGNING_KEY = os.getenv("MAILGUN_WEBHOOK_SIGNING_KEY")
+MAILGUN_SIGNATURE_MAX_AGE = 300  # secondes : au-delà, un payload signé rejoué est refusé
+
+FLUSH_INTERVAL = 5  # secondes
+FLUSH_BATCH_SIZE = 200
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS suppressions (
+        email TEXT PRIMARY KEY,
+        reason TEXT NOT NULL CHECK (reason IN ('bounce', 'complaint', 'unsubscribe')),
+        provider TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW()
+    )
+"""
+
+# Événements Brevo -> raison de suppression
+BREVO_EVENTS = {
+    "hard_bounce": "bounce",
+    "invalid_email": "bounce",
+    "blocked": "bounce",
+    "spam": "complaint",
+    "complaint": "complaint",
+    "unsubscribed": "unsubscribe",
+}
+
+# Événements Mailgun -> raison de suppression
+MAILGUN_EVENTS = {
+    "failed": "bounce",
+    "complained": "complaint",
+    "unsubscribed": "unsubscribe",
+}
+
+
+def parse_brevo_event(payload):
+    """Retourne (email, raison) pour un événement Brevo à supprimer, sinon None"""
+    if not isinstance(payload, dict):
+        return None
+    reason = BREVO_EVENTS.get(payload.get("event"))
+    email = (payload.get("email") or "").strip().lower()
+    if not reason or not email:
+        return None
+    return email, reason
+
+
+def parse_mailgun_event(payload):
+    """Retourne (email, raison) pour un événement Mailgun à supprimer, sinon None"""
+    data = payload.get("event-data") if isinstance(payload, dict) else None
+    if not isinstance(data, dict):
+        return None
+    reason = MAILGUN_EVENTS.get(data.get("event"))
+    email = (data.get("recipient") or "").strip().lower()
+    if not reason or not email:
+        return None
+    # Les échecs temporaires (boîte pleine...) ne sont pas des bounces définitifs
+    if data.get("event") == "failed" and data.get("severity") != "permanent":
+        return None
+    return email, reason
+
+
+def verify_brevo_token(token):
+    if not BREVO_WEBHOOK_TOKEN:
+        return False
+    return hmac.compare_digest(token or "", BREVO_WEBHOOK_TOKEN)
+
+
+def verify_mailgun_signature(payload):
+    """Vérifie la signature HMAC-SHA256 (timestamp + token) envoyée par Mailgun
+    et la fraîcheur du timestamp (un payload capturé ne peut pas être rejoué)"""
+    if not MAILGUN_WEBHOOK_SIGNING_KEY or not isinstance(payload, dict):
+        return False
+    signature = payload.get("signature")
+    if not isinstance(signature, dict):
+        return False
+    try:
+        timestamp = int(signature.get("timestamp", ""))
+    except (TypeError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > MAILGUN_SIGNATURE_MAX_AGE:
+        return False
+    message = f"{signature['timestamp']}{signature.get('token', '')}".encode()
+    expected = hmac.new(MAILGUN_WEBHOOK_SIGNING_KEY.encode(), message, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, str(signature.get("signature", "")))
+
+
+class SuppressionQueue:
+    """File en mémoire écrite par lots dans la table `suppressions`"""
+
+    def __init__(self, connect, interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH_SIZE):
+        self.connect = connect
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def enqueue(self, email, reason, provider):
+        with self._lock:
+            self._pending[email] = (email, reason, provider)
+            full = len(self._pending) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            rows = list(self._pending.values())
+            self._pending = {}
+        if not rows:
+            return 0
+        try:
+            conn = self.connect()
+            try:
+                queries.insert_many(conn, "insert_suppressions", rows)
+                conn.commit()
+            finally:
+                # Rendue au pool même en cas d'erreur (sinon une connexion perdue par lot raté)
+                conn.close()
+        except Exception as e:
+            print(f"Erreur écriture suppressions: {e}")
+            # On remet les événements dans la file pour le prochain lot
+            with self._lock:
+                for row in rows:
+                    self._pending.setdefault(row[0], row)
+            return 0
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+def load_suppression_set(conn):
+    """Charge toutes les adresses supprimées en mémoire (frozenset)"""
+    return frozenset(row["email"] for row in queries.fetch_all(conn, "suppressed_emails"))
@@ -0,0 +1,219 @@
+import time
+import socket
+import threading
+import psycopg2
+import pytest
+import db
+import offers
+from db import CircuitBreaker, ConnectionPool, DatabaseUnavailable
+from stale_cache import StaleCache
+import app as newsletter_app
+
+# ==========================
+# 🩹 Base lente ou arrêtée : disjoncteur, cache périmé, pool et pages 503
+# ==========================
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition jamais atteinte"
+        time.sleep(0.01)
+
+
+# --- Disjoncteur
+
+def test_breaker_opens_after_n_failures_and_fails_fast():
+    breaker = CircuitBreaker(failures=3, reset_after=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.failure()
+    breaker.before_call()  # encore fermé après 2 échecs
+    breaker.failure()
+
+    assert breaker.is_open
+    start = time.perf_counter()
+    with pytest.raises(DatabaseUnavailable):
+        breaker.before_call()
+    assert time.perf_counter() - start < 0.01
+
+
+def test_breaker_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failures=2, reset_after=60)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert not breaker.is_open
+
+
+def test_breaker_lets_a_single_half_open_trial_through():
+    breaker = CircuitBreaker(failures=1, reset_after=0.05)
+    breaker.failure()
+    with pytest.raises(DatabaseUnavailable):
+        breaker.before_call()
+    time.sleep(0.06)
+
+    breaker.before_call()  # l'essai passe
+    with pytest.raises(DatabaseUnavailable):
+        breaker.before_call()  # les autres attendent son résultat
+
+    breaker.failure()  # essai raté : rouvert pour un nouveau délai
+    with pytest.raises(DatabaseUnavailable):
+        breaker.before_call()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.success()
+    assert not breaker.is_open
+    breaker.before_call()
+
+
+# --- Cache "stale-while-revalidate"
+
+def test_stale_value_served_while_a_single_refresh_runs():
+    cache = StaleCache()
+    cache.set("count", 1234)
+    cache.invalidate("count")
+    release = threading.Event()
+    calls = []
+
+    def slow_loader():
+        calls.append(1)
+        release.wait(2)
+        return 1300
+
+    start = time.perf_counter()
+    values = [cache.get("count", slow_loader, ttl=300) for _ in range(20)]
+    assert time.perf_counter() - start < 0.1
+    assert values == [1234] * 20
+    assert len(calls) == 1
+
+    release.set()
+    wait_for(lambda: cache.get("count", slow_loader, ttl=300) == 1300)
+    assert len(calls) == 1
+
+
+def test_failed_refresh_keeps_the_stale_value():
+    cache = StaleCache()
+    cache.set("count", 1234)
+    cache.invalidate("count")
+    calls = []
+
+    def broken_loader():
+        calls.append(1)
+        raise psycopg2.OperationalError("base injoignable")
+
+    assert cache.get("count", broken_loader, ttl=300) == 1234
+    wait_for(lambda: "count" not in cache._refreshing)
+    # Conservée et considérée fraîche RETRY_DELAY secondes : pas de nouvel essai tout de suite
+    assert cache.get("count", broken_loader, ttl=300) == 1234
+    assert len(calls) == 1
+
+
+def test_first_load_failure_returns_the_default():
+    cache = StaleCache()
+
+    def broken_loader():
+        raise psycopg2.OperationalError("base injoignable")
+
+    assert cache.get("count", broken_loader, ttl=300, default=0) == 0
+    assert cache.lookup("count", broken_loader, ttl=300, default=0) == (0, False)
+    cache.set("count", 0)
+    assert cache.lookup("count", broken_loader, ttl=300, default=0) == (0, True)
+
+
+# --- Pool face à une base lente (trou noir) ou arrêtée (port fermé)
+
+@pytest.fixture
+def blackhole_port():
+    """Accepte les connexions TCP sans jamais répondre (base qui ne se réveille pas)"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(50)
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return port
+
+
+@pytest.fixture
+def fast_timeouts(monkeypatch):
+    monkeypatch.setattr(db, "DB_CONNECT_TIMEOUT", 2)
+    monkeypatch.setattr(db, "DATABASE_SSLMODE", "disable")
+
+
+@pytest.mark.parametrize("port_fixture, max_seconds", [("blackhole_port", 3), ("closed_port", 1)])
+def test_pool_gives_up_then_breaker_fails_fast(request, fast_timeouts, port_fixture, max_seconds):
+    port = request.getfixturevalue(port_fixture)
+    pool = ConnectionPool(f"postgresql://u:p@127.0.0.1:{port}/db")
+    pool.breaker = CircuitBreaker(failures=2, reset_after=60)
+
+    for _ in range(2):
+        start = time.perf_counter()
+        with pytest.raises(psycopg2.OperationalError) as error:
+            pool.acquire()
+        assert not isinstance(error.value, DatabaseUnavailable)
+        assert time.perf_counter() - start < max_seconds
+
+    start = time.perf_counter()
+    with pytest.raises(DatabaseUnavailable):
+        pool.acquire()
+    assert time.perf_counter() - start < 0.05
+
+
+# --- Pages servies quand la base est injoignable
+
+@pytest.fixture
+def database_down(monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise DatabaseUnavailable("Base de données indisponible (disjoncteur ouvert)")
+
+    monkeypatch.setattr(newsletter_app, "get_read_connection", unavailable)
+    monkeypatch.setattr(newsletter_app, "get_db_connection", unavailable)
+    monkeypatch.setattr(newsletter_app, "offer_cache", offers.PayloadCache())
+    return newsletter_app.app.test_client()
+
+
+def test_html_page_gets_the_degraded_page(database_down):
+    response = database_down.get("/newsletter-test")
+    assert response.status_code == 503
+    assert response.mimetype == "text/html"
+    assert response.headers["Retry-After"] == "30"
+
+
+def test_api_gets_a_json_503(database_down):
+    response = database_down.get("/api/offers")
+    assert response.status_code == 503
+    assert response.is_json
+    assert "error" in response.get_json()
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+
+
+def test_feed_gets_an_empty_rss_503(database_down):
+    response = database_down.get("/feed.xml")
+    assert response.status_code == 503
+    assert response.mimetype == "application/rss+xml"
+    assert response.data == b""
+    assert response.headers["Retry-After"] == "30"
+
+
+def test_cold_homepage_without_database_is_not_cacheable(database_down, monkeypatch):
+    monkeypatch.setattr(newsletter_app, "_cache", StaleCache())
+    response = database_down.get("/")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in response.headers
+
+
+def test_homepage_with_a_loaded_count_is_cacheable(database_down, monkeypatch):
+    cache = StaleCache()
+    cache.set("subscriber_count", 0)
+    monkeypatch.setattr(newsletter_app, "_cache", cache)
+    response = database_down.get("/")
+    assert "s-maxage" in response.headers["Cache-Control"]
+    assert response.headers["ETag"] == 'W/"0"'
@@ -0,0 +1,244 @@
+import io
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from PIL import Image
+import image_proxy
+import queries
+import app as newsletter_app
+
+# ==========================
+# 🖼️ Proxy de miniatures face à une origine HTTP locale
+# ==========================
+
+
+def image_bytes(size, fmt="JPEG", mode="RGB"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, "white" if mode == "RGB" else 1).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    routes = {}
+    hits = []
+    slow = {"/lente.jpg"}
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        if self.path in self.slow:
+            time.sleep(0.3)
+        status, headers, body = self.routes.get(self.path, (404, {}, b""))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def origin():
+    OriginHandler.routes = {
+        "/photo.jpg": (200, {"Content-Type": "image/jpeg"}, image_bytes((800, 600))),
+        "/lente.jpg": (200, {"Content-Type": "image/jpeg"}, image_bytes((800, 600))),
+        "/ancienne-photo.jpg": (302, {"Location": "/photo.jpg"}, b""),
+        "/boucle.jpg": (302, {"Location": "/boucle.jpg"}, b""),
+        "/vers-fichier.jpg": (302, {"Location": "file:///etc/passwd"}, b""),
+        "/panne.jpg": (500, {}, b"erreur"),
+        "/geante.png": (200, {"Content-Type": "image/png"}, image_bytes((5000, 4000), "PNG", mode="1")),
+    }
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OriginHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def reset_hits():
+    OriginHandler.hits.clear()
+
+
+@pytest.fixture
+def allow_local_origin(monkeypatch):
+    # L'origine de test écoute sur 127.0.0.1, normalement refusé
+    monkeypatch.setattr(image_proxy, "BLOCK_PRIVATE_ADDRESSES", False)
+
+
+@pytest.fixture
+def submissions(monkeypatch, tmp_path):
+    """Soumissions publiées {id: image_url} servies à la route sans base de données"""
+    published = {}
+
+    class Conn:
+        def close(self):
+            pass
+
+    def fetch_one(conn, name, *params):
+        assert name == "submission_image_url"
+        url = published.get(params[0])
+        return {"image_url": url} if url else None
+
+    monkeypatch.setattr(newsletter_app, "get_read_connection", lambda *a, **k: Conn())
+    monkeypatch.setattr(queries, "fetch_one", fetch_one)
+    monkeypatch.setattr(newsletter_app, "image_cache", image_proxy.ThumbnailCache(str(tmp_path)))
+    return published
+
+
+@pytest.fixture
+def client():
+    return newsletter_app.app.test_client()
+
+
+def thumb_path(submission_id, image_url, width=180, fmt="jpg"):
+    return f"/img/{submission_id}/{image_proxy.url_version(image_url)}/{width}.{fmt}"
+
+
+# --- Route /img
+
+def test_miss_then_hit(client, origin, submissions, allow_local_origin):
+    url = submissions[1] = f"{origin}/photo.jpg"
+
+    response = client.get(thumb_path(1, url))
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    assert Image.open(io.BytesIO(response.data)).size == (180, 135)
+    assert "immutable" in response.headers["Cache-Control"]
+    assert OriginHandler.hits == ["/photo.jpg"]
+
+    # Toutes les tailles et formats ont été générés au premier téléchargement
+    for width, fmt in ((180, "jpg"), (360, "jpg"), (360, "webp")):
+        response = client.get(thumb_path(1, url, width, fmt))
+        assert response.status_code == 200
+        assert Image.open(io.BytesIO(response.data)).width == width
+    assert OriginHandler.hits == ["/photo.jpg"]
+
+
+def test_version_mismatch_is_404(client, origin, submissions, allow_local_origin):
+    submissions[1] = f"{origin}/photo.jpg"
+    response = client.get(thumb_path(1, f"{origin}/autre-photo.jpg"))
+    assert response.status_code == 404
+    assert OriginHandler.hits == []
+
+
+def test_unpublished_submission_is_404(client, origin, submissions, allow_local_origin):
+    # La requête ne renvoie que les soumissions approuvées/publiées
+    response = client.get(thumb_path(2, f"{origin}/photo.jpg"))
+    assert response.status_code == 404
+    assert OriginHandler.hits == []
+
+
+@pytest.mark.parametrize("width, fmt", [(500, "jpg"), (180, "gif")])
+def test_unknown_size_or_format_is_404(client, submissions, width, fmt):
+    assert client.get(thumb_path(1, "http://example.com/a.jpg", width, fmt)).status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/panne.jpg", "/introuvable.jpg", "/geante.png"])
+def test_origin_failure_falls_back_to_redirect(client, origin, submissions, allow_local_origin, path):
+    url = submissions[1] = f"{origin}{path}"
+    response = client.get(thumb_path(1, url))
+    assert response.status_code == 302
+    assert response.headers["Location"] == url
+
+
+def test_concurrent_misses_download_once(origin, submissions, allow_local_origin):
+    url = submissions[1] = f"{origin}/lente.jpg"
+    paths = [thumb_path(1, url, width, fmt) for width in (180, 360) for fmt in ("jpg", "webp")] * 4
+
+    def fetch(path):
+        return newsletter_app.app.test_client().get(path).status_code
+
+    with ThreadPoolExecutor(len(paths)) as pool:
+        statuses = list(pool.map(fetch, paths))
+    assert statuses == [200] * len(paths)
+    assert OriginHandler.hits == ["/lente.jpg"]
+
+
+def test_failed_origin_is_not_refetched(client, origin, submissions, allow_local_origin):
+    url = submissions[1] = f"{origin}/panne.jpg"
+    for width, fmt in ((180, "jpg"), (180, "jpg"), (360, "webp")):
+        response = client.get(thumb_path(1, url, width, fmt))
+        assert response.status_code == 302
+    assert OriginHandler.hits == ["/panne.jpg"]
+
+
+def test_failure_expires_after_ttl(client, origin, submissions, allow_local_origin, monkeypatch):
+    url = submissions[1] = f"{origin}/panne.jpg"
+    client.get(thumb_path(1, url))
+    monkeypatch.setattr(image_proxy, "FAILURE_TTL", 0)
+    client.get(thumb_path(1, url))
+    assert OriginHandler.hits == ["/panne.jpg", "/panne.jpg"]
+
+
+def test_refused_url_stays_refused(client, origin, submissions):
+    url = submissions[1] = f"{origin}/photo.jpg"
+    assert client.get(thumb_path(1, url)).status_code == 404
+    assert client.get(thumb_path(1, url, 360, "webp")).status_code == 404
+    assert OriginHandler.hits == []
+
+
+def test_redirect_is_followed(client, origin, submissions, allow_local_origin):
+    url = submissions[1] = f"{origin}/ancienne-photo.jpg"
+    response = client.get(thumb_path(1, url))
+    assert response.status_code == 200
+    assert OriginHandler.hits == ["/ancienne-photo.jpg", "/photo.jpg"]
+
+
+def test_internal_address_is_refused(client, origin, submissions):
+    url = submissions[1] = f"{origin}/photo.jpg"
+    response = client.get(thumb_path(1, url))
+    assert response.status_code == 404
+    assert OriginHandler.hits == []
+
+
+# --- Téléchargement de l'original
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/photo.jpg",
+    "http://localhost/photo.jpg",
+    "http://10.0.0.5/photo.jpg",
+    "http://192.168.1.1/photo.jpg",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/photo.jpg",
+    "ftp://example.com/photo.jpg",
+    "file:///etc/passwd",
+])
+def test_check_source_url_refuses(url):
+    with pytest.raises(image_proxy.UnsafeImageUrl):
+        image_proxy.check_source_url(url)
+
+
+def test_redirect_hops_are_checked(origin, allow_local_origin):
+    with pytest.raises(image_proxy.UnsafeImageUrl):
+        image_proxy.fetch_source(f"{origin}/vers-fichier.jpg")
+    with pytest.raises(image_proxy.UnsafeImageUrl):
+        image_proxy.fetch_source(f"{origin}/boucle.jpg")
+    assert len(OriginHandler.hits) == 1 + image_proxy.MAX_REDIRECTS + 1
+
+
+def test_pixel_cap(origin, allow_local_origin, tmp_path):
+    cache = image_proxy.ThumbnailCache(str(tmp_path))
+    with pytest.raises(ValueError, match="trop grande"):
+        image_proxy.build_thumbnails(cache, f"{origin}/geante.png")
+    assert os.listdir(tmp_path) == []
+
+
+# --- Cache disque
+
+def test_lru_eviction_under_max_bytes(tmp_path):
+    cache = image_proxy.ThumbnailCache(str(tmp_path), max_bytes=350)
+    for age, name in enumerate(("a", "b", "c")):
+        cache.put(name, b"x" * 100)
+        os.utime(cache.path(name), (1000 + age, 1000 + age))
+
+    assert cache.get("a") is not None  # "a" redevient la plus récente
+    cache.put("d", b"x" * 100)  # 400 > 350 : éviction jusqu'à 90 % de la limite
+
+    assert sorted(os.listdir(tmp_path)) == ["a", "c", "d"]
+    assert cache.get("b") is None
+    assert cache._size == 300
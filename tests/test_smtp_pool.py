@@ -0,0 +1,172 @@
+import socket
+import smtplib
+import pytest
+from aiosmtpd.controller import Controller
+from smtp_pool import SmtpPool, is_transient
+from newsletter_template import MimeBuilder
+
+# ==========================
+# 📮 SmtpPool face à un vrai serveur SMTP local (aiosmtpd)
+# ==========================
+
+SENDER = "newsletter@test.invalid"
+
+
+class ScriptedHandler:
+    """Répond selon un scénario par destinataire : liste de réponses consommées
+    une par tentative ("disconnect" coupe la connexion), puis 250."""
+
+    def __init__(self):
+        self.script = {}
+        self.attempts = {}
+        self.delivered = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        recipient = envelope.rcpt_tos[0]
+        self.attempts[recipient] = self.attempts.get(recipient, 0) + 1
+        replies = self.script.get(recipient, [])
+        reply = replies.pop(0) if replies else "250 OK"
+        if reply == "disconnect":
+            server.transport.close()
+            return "421 closing"
+        if reply.startswith("250"):
+            self.delivered.append(recipient)
+        return reply
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = ScriptedHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield handler, controller.port
+    controller.stop()
+
+
+def send(port, recipients, **options):
+    options = {"connections": 1, "max_per_session": 100, "max_retries": 3, "backoff": 0, **options}
+    pool = SmtpPool("127.0.0.1", port, starttls=False, timeout=5, **options)
+    builder = MimeBuilder("<p>Bonjour {{ email }}</p>", SENDER, "Test")
+    errors = {}
+    stats = pool.send_all(SENDER, recipients, builder.build,
+                          on_result=lambda recipient, error: error and errors.setdefault(recipient, error))
+    return stats, errors
+
+
+@pytest.mark.parametrize("reply", ["421 4.7.0 Trop de messages", "451 4.3.0 Erreur temporaire"])
+def test_transient_reply_is_retried_on_a_new_session(smtp_server, reply):
+    handler, port = smtp_server
+    handler.script["b@test.invalid"] = [reply]
+
+    stats, errors = send(port, ["a@test.invalid", "b@test.invalid", "c@test.invalid"])
+
+    assert errors == {}
+    assert stats["sent"] == 3 and stats["failed"] == 0
+    assert stats["retries"] == 1
+    assert stats["connections"] == 2  # la session est jetée après l'erreur
+    assert handler.attempts["b@test.invalid"] == 2
+    assert sorted(handler.delivered) == ["a@test.invalid", "b@test.invalid", "c@test.invalid"]
+
+
+def test_mid_session_disconnect_reconnects(smtp_server):
+    handler, port = smtp_server
+    handler.script["b@test.invalid"] = ["disconnect"]
+
+    stats, errors = send(port, ["a@test.invalid", "b@test.invalid", "c@test.invalid"])
+
+    assert errors == {}
+    assert stats["sent"] == 3
+    assert stats["retries"] == 1
+    assert stats["connections"] == 2
+    assert handler.delivered.count("b@test.invalid") == 1
+
+
+def test_session_recycled_after_max_per_session(smtp_server):
+    handler, port = smtp_server
+    recipients = [f"abonne{i}@test.invalid" for i in range(10)]
+
+    stats, errors = send(port, recipients, max_per_session=3)
+
+    assert errors == {}
+    assert stats["sent"] == 10
+    assert stats["connections"] == 4  # 3 + 3 + 3 + 1
+    assert stats["recycled"] == 3
+    assert len(handler.sessions) == 4
+
+
+def test_permanent_error_fails_without_retry(smtp_server):
+    handler, port = smtp_server
+    handler.script["b@test.invalid"] = ["550 5.1.1 Boîte inexistante"]
+
+    stats, errors = send(port, ["a@test.invalid", "b@test.invalid", "c@test.invalid"])
+
+    assert list(errors) == ["b@test.invalid"]
+    assert isinstance(errors["b@test.invalid"], smtplib.SMTPDataError)
+    assert stats["sent"] == 2 and stats["failed"] == 1
+    assert stats["retries"] == 0
+    assert handler.attempts["b@test.invalid"] == 1
+
+
+def test_retries_are_bounded(smtp_server):
+    handler, port = smtp_server
+    handler.script["b@test.invalid"] = ["451 4.3.0 Erreur temporaire"] * 10
+
+    stats, errors = send(port, ["b@test.invalid"], max_retries=2)
+
+    assert stats["failed"] == 1 and stats["retries"] == 2
+    assert handler.attempts["b@test.invalid"] == 3
+    assert is_transient(errors["b@test.invalid"])
+
+
+def test_unreachable_server_aborts_the_run():
+    recipients = [f"abonne{i}@test.invalid" for i in range(200)]
+    stats, errors = send(free_port(), recipients, connections=4, backoff=0.01, max_connect_failures=3)
+
+    assert stats["aborted"]
+    assert stats["sent"] == 0 and stats["failed"] == 200
+    assert stats["retries"] == 0  # aucun destinataire n'a consommé ses tentatives
+    assert stats["connect_failures"] < 3 + 4
+    assert stats["elapsed"] < 2
+    assert set(errors) == set(recipients)
+
+
+def test_connect_failures_are_not_charged_to_recipients(smtp_server, monkeypatch):
+    handler, port = smtp_server
+    pool = SmtpPool("127.0.0.1", port, starttls=False, timeout=5, connections=1,
+                    max_retries=0, backoff=0, max_connect_failures=3)
+    connect = pool._connect
+    outages = [OSError("connexion refusée")] * 2
+
+    def flaky_connect():
+        if outages:
+            raise outages.pop()
+        return connect()
+
+    monkeypatch.setattr(pool, "_connect", flaky_connect)
+    builder = MimeBuilder("<p>Bonjour</p>", SENDER, "Test")
+    stats = pool.send_all(SENDER, ["a@test.invalid"], builder.build, on_result=lambda *a: None)
+
+    # max_retries=0 : si les échecs de connexion comptaient, le message serait perdu
+    assert stats["sent"] == 1 and not stats["aborted"]
+    assert stats["connect_failures"] == 2
+    assert handler.delivered == ["a@test.invalid"]
+
+
+def test_authentication_failure_aborts_immediately(monkeypatch):
+    pool = SmtpPool("127.0.0.1", free_port(), connections=2, backoff=0, max_connect_failures=5)
+
+    def refused():
+        raise smtplib.SMTPAuthenticationError(535, b"5.7.8 Identifiants invalides")
+
+    monkeypatch.setattr(pool, "_connect", refused)
+    stats = pool.send_all(SENDER, ["a@test.invalid", "b@test.invalid"], lambda r: b"", on_result=lambda *a: None)
+    assert stats["aborted"] and stats["failed"] == 2
+    assert stats["connect_failures"] <= 2
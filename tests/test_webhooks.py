@@ -0,0 +1,176 @@
+import hmac
+import json
+import time
+import hashlib
+from pathlib import Path
+import psycopg2
+import pytest
+import suppressions
+import app as newsletter_app
+
+# ==========================
+# 📬 Webhooks Brevo / Mailgun avec des payloads enregistrés
+# ==========================
+
+PAYLOADS = Path(__file__).parent / "payloads"
+BREVO_TOKEN = "jeton-brevo-test"
+MAILGUN_KEY = "key-mailgun-test"
+
+
+def load_payload(name):
+    return json.loads((PAYLOADS / name).read_text(encoding="utf-8"))
+
+
+def sign_mailgun(payload, key=MAILGUN_KEY, timestamp=None):
+    """Re-signe un payload enregistré (le timestamp d'origine est trop vieux)"""
+    signature = payload["signature"]
+    signature["timestamp"] = str(int(time.time()) if timestamp is None else timestamp)
+    message = f"{signature['timestamp']}{signature['token']}".encode()
+    signature["signature"] = hmac.new(key.encode(), message, hashlib.sha256).hexdigest()
+    return payload
+
+
+class RecordingQueue:
+    def __init__(self):
+        self.events = []
+
+    def enqueue(self, email, reason, provider):
+        self.events.append((email, reason, provider))
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    queue = RecordingQueue()
+    monkeypatch.setattr(newsletter_app, "suppression_queue", queue)
+    monkeypatch.setattr(suppressions, "BREVO_WEBHOOK_TOKEN", BREVO_TOKEN)
+    monkeypatch.setattr(suppressions, "MAILGUN_WEBHOOK_SIGNING_KEY", MAILGUN_KEY)
+    return queue.events
+
+
+@pytest.fixture
+def client():
+    return newsletter_app.app.test_client()
+
+
+# --- Brevo
+
+def test_brevo_hard_bounce_is_queued(client, queued):
+    response = client.post(f"/webhooks/brevo?token={BREVO_TOKEN}", json=load_payload("brevo_hard_bounce.json"))
+    assert response.status_code == 204
+    assert queued == [("ancien.abonne@example.com", "bounce", "brevo")]
+
+
+@pytest.mark.parametrize("query", ["", "?token=", "?token=mauvais-jeton"])
+def test_brevo_rejects_missing_or_wrong_token(client, queued, query):
+    response = client.post(f"/webhooks/brevo{query}", json=load_payload("brevo_hard_bounce.json"))
+    assert response.status_code == 403
+    assert queued == []
+
+
+def test_brevo_batch_skips_soft_bounces_and_malformed_items(client, queued):
+    response = client.post(f"/webhooks/brevo?token={BREVO_TOKEN}", json=load_payload("brevo_batch.json"))
+    assert response.status_code == 204
+    assert queued == [
+        ("plainte@example.com", "complaint", "brevo"),
+        ("depart@example.com", "unsubscribe", "brevo"),
+    ]
+
+
+def test_brevo_non_json_body(client, queued):
+    response = client.post(f"/webhooks/brevo?token={BREVO_TOKEN}", data="pas du json")
+    assert response.status_code == 204
+    assert queued == []
+
+
+# --- Mailgun
+
+def test_mailgun_permanent_failure_is_queued(client, queued):
+    payload = sign_mailgun(load_payload("mailgun_failed_permanent.json"))
+    response = client.post("/webhooks/mailgun", json=payload)
+    assert response.status_code == 204
+    assert queued == [("inconnu@example.com", "bounce", "mailgun")]
+
+
+def test_mailgun_temporary_failure_is_ignored(client, queued):
+    payload = sign_mailgun(load_payload("mailgun_failed_temporary.json"))
+    response = client.post("/webhooks/mailgun", json=payload)
+    assert response.status_code == 204
+    assert queued == []
+
+
+def test_mailgun_complaint_is_queued(client, queued):
+    payload = sign_mailgun(load_payload("mailgun_complained.json"))
+    response = client.post("/webhooks/mailgun", json=payload)
+    assert response.status_code == 204
+    assert queued == [("plainte@example.com", "complaint", "mailgun")]
+
+
+def test_mailgun_rejects_bad_signature(client, queued):
+    payload = sign_mailgun(load_payload("mailgun_failed_permanent.json"), key="autre-cle")
+    response = client.post("/webhooks/mailgun", json=payload)
+    assert response.status_code == 403
+    assert queued == []
+
+
+def test_mailgun_rejects_recorded_signature(client, queued):
+    # Signature d'origine, jamais re-signée : ni la bonne clé ni un timestamp frais
+    response = client.post("/webhooks/mailgun", json=load_payload("mailgun_failed_permanent.json"))
+    assert response.status_code == 403
+    assert queued == []
+
+
+def test_mailgun_rejects_replayed_payload(client, queued):
+    stale = int(time.time()) - suppressions.MAILGUN_SIGNATURE_MAX_AGE - 60
+    payload = sign_mailgun(load_payload("mailgun_failed_permanent.json"), timestamp=stale)
+    response = client.post("/webhooks/mailgun", json=payload)
+    assert response.status_code == 403
+    assert queued == []
+
+
+@pytest.mark.parametrize("body", [[], ["x"], {"signature": "x"}, {"signature": {"timestamp": "abc"}}])
+def test_mailgun_malformed_payload(client, queued, body):
+    response = client.post("/webhooks/mailgun", json=body)
+    assert response.status_code == 403
+    assert queued == []
+
+
+# --- Écriture par lots
+
+class FakeCursor:
+    def mogrify(self, template, args):
+        return b"('x', 'bounce', 'brevo')"
+
+    def execute(self, sql, params=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class FailingConnection:
+    def __init__(self):
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        raise psycopg2.OperationalError("connexion perdue")
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_flush_returns_connection_and_keeps_events():
+    connections = []
+
+    def connect():
+        connections.append(FailingConnection())
+        return connections[-1]
+
+    queue = suppressions.SuppressionQueue(connect)
+    queue._pending["a@example.org"] = ("a@example.org", "bounce", "brevo")
+
+    assert queue.flush() == 0
+    assert connections[0].closed
+    assert list(queue._pending) == ["a@example.org"]
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import select
+import socket
+import subprocess
+from email_validator import validate_email, EmailNotValidError
+from app import get_db_connection, generate_html_code
+from db import get_direct_connection, direct_database_url, is_pooled_url
+import jobs
+import queries
+
+# ==========================
+# 👷 Worker de tâches (process "worker" du Procfile)
+# ==========================
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+POLL_INTERVAL = 5  # secondes sans NOTIFY avant de revérifier la file
+SEND_TIMEOUT = int(os.getenv("SEND_NEWSLETTER_TIMEOUT", "10800"))  # secondes avant d'arrêter un envoi bloqué
+
+HANDLERS = {}
+
+
+def job_handler(job_type):
+    def decorator(f):
+        HANDLERS[job_type] = f
+        return f
+    return decorator
+
+
+@job_handler("send_newsletter")
+def send_newsletter(payload):
+    """Lance le script d'envoi du fournisseur choisi et garde la fin de sa sortie"""
+    scripts = {"brevo": "send_newsletter_brevo.py", "mailgun": "send_newsletter_mailgun.py"}
+    script = scripts[payload.get("provider", "brevo")]
+    try:
+        process = subprocess.run([sys.executable, script], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), timeout=SEND_TIMEOUT)
+    except subprocess.TimeoutExpired as e:
+        output = e.stdout.decode(errors="replace") if isinstance(e.stdout, bytes) else (e.stdout or "")
+        raise RuntimeError(f"Envoi arrêté après {SEND_TIMEOUT}s\n{output[-2000:]}")
+    output = (process.stdout + process.stderr)[-2000:]
+    if process.returncode != 0:
+        raise RuntimeError(output)
+    return output
+
+
+@job_handler("render_newsletter")
+def render_newsletter(payload):
+    """Génère le brouillon HTML (servi sur /newsletter-test) à partir des soumissions approuvées.
+
+    Le brouillon est enregistré en base : le process web ne voit pas le disque du worker.
+    """
+    conn = get_db_connection()
+    try:
+        submissions = queries.fetch_all(conn, "approved_submissions")
+        draft = queries.fetch_one(conn, "insert_newsletter_draft",
+                                  generate_html_code(submissions), len(submissions))
+        conn.commit()
+    finally:
+        conn.close()
+    return f"Brouillon #{draft['id']} : {len(submissions)} soumission(s)"
+
+
+@job_handler("import_subscribers")
+def import_subscribers(payload):
+    """Ajoute en masse une liste d'emails (import CSV depuis l'admin)"""
+    emails, invalid = set(), 0
+    for raw in payload.get("emails", []):
+        try:
+            emails.add(validate_email(raw.strip().lower(), check_deliverability=False).email)
+        except EmailNotValidError:
+            invalid += 1
+
+    conn = get_db_connection()
+    rows = queries.insert_many(conn, "insert_subscribers", [(e,) for e in emails], fetch=True)
+    conn.commit()
+    conn.close()
+    return f"{len(rows)} ajouté(s), {len(emails) - len(rows)} déjà inscrit(s), {invalid} invalide(s)"
+
+
+def main():
+    # Créneaux (verrous de session), LISTEN et locked_pid exigent une session
+    # PostgreSQL stable : jamais derrière PgBouncer en mode transaction
+    if is_pooled_url(direct_database_url()):
+        sys.exit("❌ DATABASE_DIRECT_URL pointe sur un pooler : le worker a besoin d'une connexion directe")
+
+    conn = get_direct_connection()
+    listen = get_direct_connection()
+    listen.autocommit = True
+    listen.cursor().execute("LISTEN jobs")
+    print(f"👷 Worker {WORKER_ID} prêt ({', '.join(HANDLERS)})")
+
+    last_reap = 0
+    while True:
+        if time.time() - last_reap > 60:
+            if jobs.requeue_stale(conn):
+                print("♻️ Tâches perdues remises en file")
+            conn.commit()
+            last_reap = time.time()
+
+        job = jobs.claim(conn, WORKER_ID, list(HANDLERS))
+        if job is None:
+            # Attend un NOTIFY (nouvelle tâche) ou le prochain tour de vérification
+            if select.select([listen], [], [], POLL_INTERVAL) != ([], [], []):
+                listen.poll()
+                listen.notifies.clear()
+            continue
+
+        print(f"▶️ Tâche {job['id']} ({job['job_type']}), tentative {job['attempts']}")
+        try:
+            result = HANDLERS[job["job_type"]](job["payload"])
+        except Exception as e:
+            print(f"❌ Tâche {job['id']} en erreur: {e}")
+            jobs.fail(conn, job, str(e))
+        else:
+            print(f"✅ Tâche {job['id']} terminée")
+            jobs.complete(conn, job, result or "")
+
+
+if __name__ == "__main__":
+    main()